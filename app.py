@@ -1,13 +1,64 @@
+import hashlib
+import itertools
 import json
+import os
+import threading
+import time
+
+SCRIPT_STARTED = time.perf_counter()  # before the imports below: a cold start's imports count towards first paint
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 
 import streamlit as st
 import pandas as pd
-import altair as alt
 from dateutil.relativedelta import relativedelta
 
-import gspread
-from google.oauth2.service_account import Credentials
+# altair, gspread and google-auth are imported where they are used (the
+# Dashboard chart, the Sheets connection), after the page shell is drawn.
+from pnl_core import (
+    DailyTotals,
+    DateSlices,
+    add_net_cols,
+    build_cube,
+    build_search_index,
+    calc_amount,
+    consolidate_targets,
+    cube_monthly,
+    cube_total,
+    get_targets_for_year,
+    monthly_target_for,
+    month_range,
+    period_range,
+    pnl_by,
+    pnl_kpis,
+    search_mask,
+    update_cube,
+    year_range,
+)
+from archive import ParquetArchive, SheetsArchive, archive_year, closed_years, is_archived, read_partition, with_partitions
+from exports import EXPORT_FORMATS, export_bytes
+from grid import FILTER_COLUMNS, PAGE_SIZES, filter_options, filter_rows, grid_page, page_count, sort_positions
+from importer import IMPORT_FORMATS, DedupeIndex, ImportColumnsError, prepare_import, write_import
+from profiling import SHEETS_QUOTA_PER_MINUTE, Profiler, bind_profile, stage
+from snapshot import SnapshotStore
+from write_queue import WriteBehindQueue
+from storage import (
+    TX_CATEGORICAL,
+    TX_EDITABLE,
+    ConcurrentEditError,
+    ConsolidatedBackend,
+    HeaderMismatchError,
+    IdBlocks,
+    MirroredBackend,
+    SheetsBackend,
+    SQLiteBackend,
+    build_id_index,
+    consolidate_transactions,
+    duplicate_ids,
+    memory_report,
+    transaction_fingerprints,
+)
 
 
 # -----------------------------
@@ -84,26 +135,6 @@ def money(x: float) -> str:
         return "฿0"
 
 
-def calc_amount(qty, unit_price, vat_percent):
-    qty = float(qty or 0)
-    unit_price = float(unit_price or 0)
-    vat_percent = float(vat_percent or 0)
-    base = qty * unit_price
-    vat = base * (vat_percent / 100.0)
-    net = base + vat
-    return base, vat, net
-
-
-def month_range(d: date):
-    start = d.replace(day=1)
-    end = (start + relativedelta(months=1)) - relativedelta(days=1)
-    return start, end
-
-
-def year_range(y: int):
-    return date(y, 1, 1), date(y, 12, 31)
-
-
 def progress_block(title: str, current: float, target: float, gap_label: str):
     if target <= 0:
         st.markdown(
@@ -145,11 +176,54 @@ def progress_block(title: str, current: float, target: float, gap_label: str):
     )
 
 
+# -----------------------------
+# Profiling (opt-in: DEBUG_PROFILING / ?debug=1 shows the panel, PROFILE_LOG writes JSON lines)
+# -----------------------------
+@st.cache_resource
+def get_profiler() -> Profiler:
+    return Profiler(st.secrets.get("PROFILE_LOG") or None)
+
+
+def profiling_panel(profile):
+    record = get_profiler().finish(profile)
+    with st.sidebar.expander("🛠 Profiling", expanded=True):
+        first_paint = "–" if record["first_paint_s"] is None else f"{record['first_paint_s'] * 1000:.0f} ms"
+        st.caption(
+            f"rerun {record['total_s'] * 1000:.0f} ms • first paint {first_paint}"
+            f"{' (cold start)' if record['cold_start'] else ''} • page {record['page']}"
+        )
+        stages = pd.DataFrame(
+            [(k, round(v * 1000, 1)) for k, v in record["stages"].items()], columns=["stage", "ms"]
+        )
+        st.dataframe(stages, use_container_width=True, hide_index=True)
+        calls = record["api_calls"]
+        st.caption(
+            f"API calls this rerun: {sum(calls.values())} {calls or ''} • "
+            f"last 60 s: {record['api_calls_last_minute']} / {SHEETS_QUOTA_PER_MINUTE}"
+        )
+        st.markdown("**p50 / p95 (recent reruns)**")
+        st.dataframe(get_profiler().percentiles(), use_container_width=True, hide_index=True)
+
+
+show_profiling = bool(st.secrets.get("DEBUG_PROFILING", False)) or st.query_params.get("debug") == "1"
+rerun_profile = None
+if show_profiling or get_profiler().log_path:
+    rerun_profile = get_profiler().begin(
+        st.session_state.setdefault("_profile_session", os.urandom(4).hex()),
+        st.session_state.get("_rerun_profile"),
+        t0=SCRIPT_STARTED,
+    )
+    st.session_state["_rerun_profile"] = rerun_profile
+
+
 # -----------------------------
 # Google Sheets connection
 # -----------------------------
 @st.cache_resource
 def get_gspread_client():
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
@@ -161,177 +235,790 @@ def get_gspread_client():
 
     info = json.loads(raw.strip())
     creds = Credentials.from_service_account_info(info, scopes=scopes)
-    return gspread.authorize(creds)
+    return get_profiler().instrument(gspread.authorize(creds))
 
 
-def get_worksheets():
+def gsheet_id() -> str:
     sheet_id = st.secrets.get("GSHEET_ID", "")
     if not sheet_id:
         st.error("Missing GSHEET_ID in Secrets")
         st.stop()
+    return sheet_id
 
-    gc = get_gspread_client()
-    sh = gc.open_by_key(sheet_id)
 
-    tx_ws = sh.worksheet("transactions")
-    try:
-        ach_ws = sh.worksheet("achievement")
-    except Exception:
-        ach_ws = None
-
-    return sh, tx_ws, ach_ws
-
-
-TX_HEADERS = [
-    "id",
-    "tx_date",
-    "project",
-    "tx_type",
-    "category",
-    "vendor",
-    "description",
-    "qty",
-    "unit_price",
-    "vat_percent",
-    "payment",
-    "status",
-    "ref",
-    "created_at",
-]
-ACH_HEADERS = ["year", "month", "target"]  # month 0 = yearly target row
-
-
-def ensure_headers(ws, headers):
-    existing = ws.row_values(1)
-    if existing == headers:
-        return
-    if len(existing) == 0:
-        ws.append_row(headers)
-        return
-    st.error("Header row ในชีทไม่ตรงตามที่ต้องการ กรุณาตั้งหัวคอลัมน์ให้ตรงนี้")
-    st.code(",".join(headers))
-    st.stop()
+@st.cache_resource
+def get_id_blocks(sheet_id: str) -> IdBlocks:
+    # Not cleared by "โหลดข้อมูลใหม่": a reopened backend keeps the ids reserved so far.
+    return IdBlocks()
 
 
-def read_transactions(ws) -> pd.DataFrame:
-    ensure_headers(ws, TX_HEADERS)
-    records = ws.get_all_records()
-    df = pd.DataFrame(records)
-    if df.empty:
-        return df
-    df["tx_date"] = pd.to_datetime(df["tx_date"], errors="coerce")
-    for col in ["qty", "unit_price", "vat_percent"]:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
-    df["id"] = pd.to_numeric(df["id"], errors="coerce").fillna(0).astype(int)
-    return df
+@st.cache_resource(show_spinner=False)
+def get_sheets_backend(sheet_id: str) -> SheetsBackend:
+    # Spreadsheet/worksheet handles (and the backend's header check) are kept
+    # across reruns: opening them costs an API call per tab.
+    with stage("get_worksheets"):
+        return SheetsBackend.open(get_gspread_client(), sheet_id, get_id_blocks(sheet_id))
 
 
-def next_id(df: pd.DataFrame) -> int:
-    return 1 if df.empty else int(df["id"].max()) + 1
-
-
-def append_transaction(ws, row: dict):
-    values = [
-        row["id"],
-        row["tx_date"],
-        row.get("project", ""),
-        row["tx_type"],
-        row.get("category", ""),
-        row.get("vendor", ""),
-        row.get("description", ""),
-        row.get("qty", 1),
-        row.get("unit_price", 0),
-        row.get("vat_percent", 0),
-        row.get("payment", ""),
-        row.get("status", ""),
-        row.get("ref", ""),
-        row.get("created_at", ""),
-    ]
-    ws.append_row(values, value_input_option="USER_ENTERED")
+@st.cache_resource
+def get_sqlite_backend(path: str) -> SQLiteBackend:
+    return SQLiteBackend(path)
+
+
+@st.cache_resource
+def get_mirrored_backend(path: str, sheet_id: str) -> MirroredBackend:
+    return MirroredBackend(get_sqlite_backend(path), get_sheets_backend(sheet_id))
+
 
+READ_ONLY_NOTE = "มุมมองรวมทุกบริษัทเป็นแบบอ่านอย่างเดียว — เลือกบริษัทที่แถบด้านข้างเพื่อเพิ่ม/ลบ/ตั้งเป้า"
 
-def find_row_by_id(ws, target_id: int):
-    values = ws.get_all_values()
-    if len(values) <= 1:
-        return None
-    for i in range(1, len(values)):
-        row = values[i]
-        if not row:
+
+@st.cache_resource(show_spinner=False)
+def get_entity_backends(sheet_ids) -> ConsolidatedBackend:
+    # Spreadsheets are opened concurrently; one that fails is reported, not
+    # fatal (and retried after "โหลดข้อมูลใหม่").
+    client = get_gspread_client()
+    id_blocks = {sid: get_id_blocks(sid) for sid in sheet_ids}
+    with stage("get_worksheets"), ThreadPoolExecutor(max_workers=len(sheet_ids)) as pool:
+        futures = {sid: pool.submit(bind_profile(SheetsBackend.open), client, sid, id_blocks[sid]) for sid in sheet_ids}
+    parts, errors = {}, {}
+    for sid, fut in futures.items():
+        try:
+            backend = fut.result()
+        except Exception as e:
+            errors[sid] = f"{type(e).__name__}: {e}"
             continue
+        label = getattr(backend.tx_ws.spreadsheet, "title", "") or sid
+        parts[label if label not in parts else f"{label} ({sid[:6]})"] = backend
+    return ConsolidatedBackend(parts, errors)
+
+
+def get_storage():
+    """Backend from Secrets: STORAGE_BACKEND = "sheets" (default) or "sqlite".
+
+    With "sqlite", SQLITE_PATH picks the file and MIRROR_TO_SHEETS = true also
+    writes every change to the Google Sheet. With "sheets", GSHEET_IDS (a list
+    or comma-separated ids, one spreadsheet per entity) gives a consolidated
+    backend instead of the single GSHEET_ID one.
+    """
+    kind = st.secrets.get("STORAGE_BACKEND", "sheets")
+    if kind == "sqlite":
+        path = st.secrets.get("SQLITE_PATH", "pnl.db")
+        if st.secrets.get("MIRROR_TO_SHEETS", False):
+            return with_archive(get_mirrored_backend(path, gsheet_id()))
+        return with_archive(get_sqlite_backend(path))
+    sheet_ids = st.secrets.get("GSHEET_IDS", [])
+    if isinstance(sheet_ids, str):
+        sheet_ids = [s.strip() for s in sheet_ids.split(",") if s.strip()]
+    if sheet_ids:
+        # A fresh view per rerun over the cached backends: read errors that
+        # load_parts records on it go away with the rerun.
+        entities = get_entity_backends(tuple(sheet_ids))
+        return ConsolidatedBackend(entities.parts, entities.errors)
+    return with_archive(get_sheets_backend(gsheet_id()))
+
+
+def with_archive(store):
+    """Attach the cold-year archive from Secrets: ARCHIVE = "parquet" (ARCHIVE_DIR) or "sheets"."""
+    kind = st.secrets.get("ARCHIVE", "")
+    if kind == "parquet":
+        store.archive = ParquetArchive(st.secrets.get("ARCHIVE_DIR", "archive"))
+    elif kind == "sheets":
+        sheets = store if isinstance(store, SheetsBackend) else getattr(store, "mirror", None)
+        if sheets is None:
+            st.error("ARCHIVE = sheets ต้องใช้กับ Google Sheets (หรือ MIRROR_TO_SHEETS)")
+            st.stop()
+        store.archive = SheetsArchive(sheets.tx_ws.spreadsheet)
+    return store
+
+
+def stop_on_bad_headers(err: HeaderMismatchError):
+    st.error("Header row ในชีทไม่ตรงตามที่ต้องการ กรุณาตั้งหัวคอลัมน์ให้ตรงนี้")
+    st.code(",".join(err.headers))
+    st.stop()
+
+
+# -----------------------------
+# Shared data cache (all sessions)
+# -----------------------------
+CACHE_TTL_SECONDS = 300  # hard expiry (full reload), even if the revision looks unchanged
+REVISION_CHECK_SECONDS = 15  # how often to ask Drive for the spreadsheet revision
+REVALIDATE_POLL_SECONDS = 2  # how often a page served from a snapshot checks whether fresh data is in
+
+
+class DataCache:
+    """Parsed DataFrames shared by every session of this process.
+
+    An entry is served from memory until the TTL expires or the spreadsheet
+    revision (Drive ``modifiedTime``) changes. Writers call ``invalidate``.
+    ``loader(prev)`` returns ``(df, state)``; ``prev`` is the cached
+    ``(df, state)`` when the entry may be brought up to date incrementally
+    (revision moved, or ``invalidate(full=False)``), otherwise None.
+    Every load gets a new ``df.attrs["data_version"]``; structures derived
+    from a load (search index, ...) are kept on the entry via ``derived``.
+    A derived structure registered with ``update(value, added, removed)``
+    is carried over a delta sync or ``patch`` instead of being rebuilt.
+
+    With ``snapshot=True`` (remote sheets) every load is also saved to disk.
+    The first get() of such a key in a process serves that snapshot at once
+    and revalidates it on a background thread (other sessions keep getting
+    the snapshot meanwhile); a load that fails keeps serving the last good
+    data instead of raising, unless the sheet's header row no longer matches. ``freshness`` says how old that data is.
+    """
+
+    def __init__(self, snapshots: SnapshotStore = None):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}
+        self._generations = {}  # bumped by invalidate(); stale loads are not stored
+        self._versions = itertools.count(1)
+        self._updaters = {}  # (key, name) -> update(value, added, removed)
+        self._snapshots = snapshots
+        self._snapshot_served = set()  # keys served from disk once already
+        # One writer thread, so snapshots of a key land in load order.
+        self._snapshot_writer = ThreadPoolExecutor(max_workers=1) if snapshots is not None else None
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, loader, revision_fn, ttl=CACHE_TTL_SECONDS, snapshot=False):
+        # One loader per key at a time; other sessions wait and reuse the result.
+        # ttl=None keeps the entry until invalidate() (data that cannot change).
+        snapshot = snapshot and self._snapshots is not None
+        if snapshot:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and entry["revalidating"]:
+                return entry["df"].copy(deep=False)  # stale while revalidating
+            if entry is None and key not in self._snapshot_served:
+                served = self._serve_snapshot(key, loader, revision_fn)
+                if served is not None:
+                    return served
+        with self._key_lock(key):
+            return self._get(key, loader, revision_fn, ttl, snapshot)
+
+    def _get(self, key, loader, revision_fn, ttl, snapshot):
+        # Called with the key lock held.
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        revision = None
+        prev = None
+        if entry is not None and snapshot and entry["retry_at"] > now:
+            return entry["df"].copy(deep=False)  # the last load failed: wait before retrying
+        if entry is not None and (ttl is None or now - entry["loaded_at"] < ttl):
+            if not entry["stale"]:
+                if now - entry["checked_at"] < REVISION_CHECK_SECONDS:
+                    return entry["df"].copy(deep=False)
+                revision = revision_fn()
+                if revision is None or revision == entry["revision"]:
+                    entry["checked_at"] = now
+                    if revision is not None:
+                        entry["source"] = "live"  # a snapshot confirmed current
+                    return entry["df"].copy(deep=False)
+            prev = (entry["df"], entry["state"])
+
+        if revision is None:
+            revision = revision_fn()
+        generation = self._generations.get(key, 0)
+        try:
+            df, state = loader(prev)
+        except HeaderMismatchError:
+            raise  # the sheet needs fixing: not something to ride out on old data
+        except Exception as e:
+            if not snapshot or entry is None:
+                raise
+            entry.update(error=f"{type(e).__name__}: {e}", retry_at=now + REVISION_CHECK_SECONDS)
+            return entry["df"].copy(deep=False)
+        return self._store(key, entry, prev, df, state, revision, generation, snapshot)
+
+    def _store(self, key, entry, prev, df, state, revision, generation, snapshot):
+        # Keep a finished load, unless invalidate()/patch() ran since it started.
+        df.attrs["data_version"] = next(self._versions)
+        now = time.monotonic()
+        # A delta sync does not reset the TTL, so edits it cannot see
+        # (rows changed above the tail) still get picked up by a full reload.
+        delta = prev is not None and (state or {}).get("delta")
+        loaded_at = entry["loaded_at"] if delta else now
+        if prev is not None and df is prev[0]:
+            derived = dict(entry["derived"])  # nothing new
+        elif delta:
+            added = df.loc[df.index.difference(prev[0].index)]
+            derived = self._carry(key, entry["derived"], added, None)
+        else:
+            derived = {}
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = self._entry(df, state, revision, loaded_at, now, derived)
+        if snapshot:
+            self._snapshot_writer.submit(self._save_snapshot, key, df, state, revision)
+        return df.copy(deep=False)
+
+    @staticmethod
+    def _entry(df, state, revision, loaded_at, checked_at, derived, **extra):
+        entry = dict(
+            df=df,
+            state=state,
+            revision=revision,
+            loaded_at=loaded_at,
+            checked_at=checked_at,
+            stale=False,
+            derived=derived,
+            as_of=datetime.now(),  # wall-clock time of the data (a snapshot's: when it was saved)
+            source="live",
+            revalidating=False,
+            error=None,
+            retry_at=0.0,
+        )
+        entry.update(extra)
+        return entry
+
+    def _serve_snapshot(self, key, loader, revision_fn):
+        with self._key_lock(key):
+            if key in self._snapshot_served or key in self._entries:
+                return None
+            self._snapshot_served.add(key)
+            saved = self._snapshots.load(key)
+            if saved is None:
+                return None
+            df, meta = saved
+            df.attrs["data_version"] = next(self._versions)
+            with self._lock:
+                # checked_at=-inf: the first check asks the backend for its revision.
+                self._entries[key] = self._entry(
+                    df, meta["state"], meta["revision"], time.monotonic(), float("-inf"), {},
+                    as_of=meta["saved_at"], source="snapshot", revalidating=True,
+                )
+        threading.Thread(target=self._revalidate, args=(key, loader, revision_fn), daemon=True).start()
+        return df.copy(deep=False)
+
+    def _revalidate(self, key, loader, revision_fn):
+        # One revision call if the snapshot is still current; otherwise a
+        # delta sync from the snapshot's state (or a full load). Runs without
+        # the key lock, so sessions keep using the snapshot (and building
+        # structures from it) meanwhile.
         try:
-            rid = int(str(row[0]).strip())
+            with self._lock:
+                entry = self._entries.get(key)
+                generation = self._generations.get(key, 0)
+            if entry is None:
+                return
+            revision = revision_fn()
+            if revision is not None and revision == entry["revision"]:
+                entry.update(source="live", checked_at=time.monotonic())
+                return
+            prev = (entry["df"], entry["state"])
+            try:
+                df, state = loader(prev)
+            except HeaderMismatchError:
+                # Not something to ride out on the snapshot: drop it, so the
+                # next get() loads again and raises to the page.
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                return
+            except Exception as e:
+                entry.update(error=f"{type(e).__name__}: {e}", retry_at=time.monotonic() + REVISION_CHECK_SECONDS)
+                return
+            with self._key_lock(key):
+                self._store(key, entry, prev, df, state, revision, generation, snapshot=True)
+        finally:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["revalidating"] = False
+
+    def _save_snapshot(self, key, df, state, revision):
+        try:
+            self._snapshots.save(key, df, state, revision)
         except Exception:
-            continue
-        if rid == int(target_id):
-            return i + 1  # sheet row number
-    return None
+            pass  # best effort: the next load tries again
+
+    def freshness(self, keys) -> dict:
+        """Oldest ``as_of`` among ``keys`` served from a snapshot or after a failed load, or None if all are live."""
+        with self._lock:
+            entries = [self._entries[k] for k in keys if k in self._entries]
+        behind = [e for e in entries if e["source"] == "snapshot" or e["error"]]
+        if not behind:
+            return None
+        return dict(
+            as_of=min(e["as_of"] for e in behind),
+            revalidating=any(e["revalidating"] for e in behind),
+            error=next((e["error"] for e in behind if e["error"]), None),
+        )
+
+    def _carry(self, key, derived, added, removed):
+        # Labels may have moved, so only structures with an updater survive.
+        return {
+            name: self._updaters[(key, name)](value, added, removed)
+            for name, value in derived.items()
+            if (key, name) in self._updaters
+        }
+
+    def patch(self, key, fn, removed_labels=(), added_labels=()):
+        # Apply a local write to the cached entry: fn(df, state) -> (df, state),
+        # or None to drop it. ``removed_labels`` are the rows fn takes out,
+        # ``added_labels`` the rows it puts in (an edit is both).
+        # The entry is left stale so the next get() confirms it against the
+        # sheet with a delta sync.
+        with self._key_lock(key):
+            with self._lock:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                entry = self._entries.get(key)
+            if entry is None:
+                return
+            removed = entry["df"].loc[entry["df"].index.intersection(list(removed_labels))]
+            patched = fn(entry["df"], entry["state"])
+            if patched is not None:
+                added = patched[0].loc[patched[0].index.intersection(list(added_labels))]
+                derived = self._carry(key, entry["derived"], added, removed)
+            with self._lock:
+                if patched is None:
+                    self._entries.pop(key, None)
+                    return
+                df, state = patched
+                df.attrs["data_version"] = next(self._versions)
+                entry.update(df=df, state=state, stale=True, derived=derived)
+
+    def derived(self, key, name, df, build, update=None):
+        # build(df) runs once per load; a df from an older load is built uncached.
+        with self._key_lock(key):
+            if update is not None:
+                self._updaters[(key, name)] = update
+            entry = self._entries.get(key)
+            if entry is None or entry["df"].attrs.get("data_version") != df.attrs.get("data_version"):
+                return build(df)
+            if name not in entry["derived"]:
+                entry["derived"][name] = build(entry["df"])
+            return entry["derived"][name]
+
+    def compose(self, key, token, build):
+        # An entry built from other entries (build() -> df), rebuilt only when
+        # ``token`` (e.g. the parts' data versions) changes.
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is not None and entry["state"] == token:
+                return entry["df"].copy(deep=False)
+            df = build()
+            df.attrs["data_version"] = next(self._versions)
+            now = time.monotonic()
+            with self._lock:
+                self._entries[key] = self._entry(df, token, None, now, now, {})
+            return df.copy(deep=False)
+
+    def base(self, key, df):
+        # The cached frame ``df`` was read from, before any write-queue overlay.
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is None or entry["df"].attrs.get("data_version") != df.attrs.get("data_version"):
+                return df
+            return entry["df"]
+
+    def invalidate(self, key=None, full=True):
+        # full=False keeps the entry so the next get() can delta-sync it.
+        with self._lock:
+            keys = set(self._entries) | set(self._generations) if key is None else [key]
+            for k in keys:
+                if full:
+                    self._entries.pop(k, None)
+                elif k in self._entries:
+                    self._entries[k]["stale"] = True
+                self._generations[k] = self._generations.get(k, 0) + 1
+
+
+@st.cache_resource
+def get_data_cache() -> DataCache:
+    snapshot_dir = st.secrets.get("SNAPSHOT_DIR", ".pnl_snapshot")
+    return DataCache(SnapshotStore(snapshot_dir) if snapshot_dir else None)
+
+
+@st.cache_resource
+def get_write_queue(key, _store) -> WriteBehindQueue:
+    # One queue (and worker thread) per backend, shared by all sessions.
+    journal_dir = st.secrets.get("WRITE_JOURNAL_DIR", ".pnl_journal")
+    name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    queue = WriteBehindQueue(_store, get_data_cache(), os.path.join(journal_dir, f"{name}.json"))
+    queue.start()
+    return queue
+
+
+def write_queue(store) -> WriteBehindQueue:
+    return get_write_queue(store.cache_key("transactions"), store)
+
+
+def load_parts(store: ConsolidatedBackend, tab: str) -> dict:
+    # All entities at once, so the wait is the slowest sheet, not the sum.
+    # Streamlit caches are resolved here, on the script thread.
+    cache = get_data_cache()
+    queues = {label: write_queue(part) for label, part in store.parts.items()}
+
+    def load_one(label, part):
+        if tab == "transactions":
+            df = cache.get(part.cache_key(tab), part.sync_transactions, part.revision, snapshot=part.remote)
+            return queues[label].overlay(df)
+        df = cache.get(
+            part.cache_key(tab), lambda prev: (part.read_achievement(), None), part.revision, snapshot=part.remote
+        )
+        return queues[label].overlay_targets(df)
+
+    parts = {label: part for label, part in store.parts.items() if tab == "transactions" or part.has_achievement}
+    with ThreadPoolExecutor(max_workers=max(len(parts), 1)) as pool:
+        futures = {label: pool.submit(bind_profile(load_one), label, part) for label, part in parts.items()}
+    frames = {}
+    for label, fut in futures.items():
+        try:
+            frames[label] = fut.result()
+        except Exception as e:
+            store.errors[label] = f"{type(e).__name__}: {e}"
+    return frames
+
+
+def load_transactions(store, years=()) -> pd.DataFrame:
+    """The backend's rows plus, for archived ``years``, their partitions; queued writes on top."""
+    if store.read_only:
+        frames = load_parts(store, "transactions")
+        token = tuple(
+            (label, df.attrs.get("data_version"), write_queue(store.parts[label]).version())
+            for label, df in frames.items()
+        )
+        return get_data_cache().compose(
+            store.cache_key("transactions"), token, lambda: consolidate_transactions(frames)
+        )
+    try:
+        with stage("read_transactions"):
+            df = get_data_cache().get(
+                store.cache_key("transactions"), store.sync_transactions, store.revision, snapshot=store.remote
+            )
+    except HeaderMismatchError as e:
+        stop_on_bad_headers(e)
+    cold = sorted(set(years) & set(archived_years(store)))
+    if cold:
+        df = add_partitions(store, df, cold)
+    return write_queue(store).overlay(df)
+
+
+def archived_years(store) -> list:
+    if store.archive is None:
+        return []
+    years = get_data_cache().get(
+        ("archive", store.archive.key(), "years"), lambda prev: (pd.DataFrame({"year": store.archive.years()}), None), store.revision
+    )
+    return years["year"].tolist()
+
+
+def load_partition(store, year: int) -> pd.DataFrame:
+    # Closed years do not change: read once, then kept until archiving adds to them.
+    with stage("read_partition"):
+        return get_data_cache().get(
+            ("archive", store.archive.key(), year), lambda prev: (read_partition(store.archive, year), None), lambda: None, ttl=None
+        )
+
+
+def add_partitions(store, hot: pd.DataFrame, years) -> pd.DataFrame:
+    # Its own cache entry (and derived structures), rebuilt when the hot load changes.
+    key = (store.cache_key("transactions"), "archive", tuple(years))
+    parts = [load_partition(store, y) for y in years]
+    token = (hot.attrs.get("data_version"), *(p.attrs.get("data_version") for p in parts))
+    df = get_data_cache().compose(key, token, lambda: with_partitions(hot, parts))
+    df.attrs["cache_key"] = key
+    return df
+
+
+def data_as_of_badge(info: dict):
+    text = f"🕒 ข้อมูล ณ {info['as_of']:%d/%m/%Y %H:%M}"
+    if info["revalidating"]:
+        st.caption(text + " • กำลังตรวจสอบข้อมูลล่าสุด…")
+    elif info["error"]:
+        st.warning(text + f" • เชื่อมต่อแหล่งข้อมูลไม่ได้ ({info['error']}) จะลองใหม่อัตโนมัติ")
+    else:
+        st.caption(text)
 
 
-def delete_transaction_by_id(ws, target_id: int) -> bool:
-    rownum = find_row_by_id(ws, target_id)
-    if rownum is None:
-        return False
-    ws.delete_rows(rownum)
-    return True
+@st.fragment(run_every=REVALIDATE_POLL_SECONDS)
+def revalidation_badge(keys):
+    # Polls while a snapshot is being checked; redraws the page once the
+    # fresh data (or the confirmation that the snapshot was current) is in.
+    info = get_data_cache().freshness(keys)
+    if info is None or not info["revalidating"]:
+        st.rerun()
+    data_as_of_badge(info)
+
+
+def frame_key(store, df: pd.DataFrame):
+    # Cache entry ``df`` was loaded into: the backend's, or a hot + archive view.
+    return df.attrs.get("cache_key") or store.cache_key("transactions")
+
+
+def load_achievement(store) -> pd.DataFrame:
+    if store.read_only:
+        return consolidate_targets(list(load_parts(store, "achievement").values()))
+    try:
+        df = get_data_cache().get(
+            store.cache_key("achievement"),
+            lambda prev: (store.read_achievement(), None),
+            store.revision,
+            snapshot=store.remote,
+        )
+    except HeaderMismatchError as e:
+        stop_on_bad_headers(e)
+    return write_queue(store).overlay_targets(df)
+
+
+def get_search_index(store, df: pd.DataFrame) -> pd.Series:
+    index = get_data_cache().derived(frame_key(store, df), "search_index", df, build_search_index)
+    queued = df.index.difference(index.index)  # rows still in the write queue
+    if len(queued):
+        index = pd.concat([index, build_search_index(df.loc[queued])])
+    return index
+
+
+def get_id_index(store, df: pd.DataFrame) -> pd.Series:
+    return get_data_cache().derived(frame_key(store, df), "id_index", df, build_id_index)
+
+
+def get_cube(store, df_all: pd.DataFrame) -> pd.DataFrame:
+    # Kept up to date across delta syncs and flushed deletes, then adjusted
+    # for whatever is still in the write queue.
+    key = frame_key(store, df_all)
+    cache = get_data_cache()
+    cube = cache.derived(key, "cube", df_all, build_cube, update=update_cube)
+    added, removed = write_queue(store).pending_changes(cache.base(key, df_all))
+    return update_cube(cube, added, removed)
+
+
+def get_daily_totals(store, df_all: pd.DataFrame) -> DailyTotals:
+    # Same upkeep as get_cube: incremental on the cache, queued writes on top.
+    key = frame_key(store, df_all)
+    cache = get_data_cache()
+    totals = cache.derived(key, "daily_totals", df_all, DailyTotals.from_frame, update=DailyTotals.updated)
+    added, removed = write_queue(store).pending_changes(cache.base(key, df_all))
+    return totals.updated(added, removed)
+
+
+def get_dedupe_index(store, df_all: pd.DataFrame) -> DedupeIndex:
+    # Same upkeep as get_cube, so an import checks against queued rows too.
+    key = frame_key(store, df_all)
+    cache = get_data_cache()
+    index = cache.derived(key, "dedupe_index", df_all, DedupeIndex.from_frame, update=DedupeIndex.updated)
+    added, removed = write_queue(store).pending_changes(cache.base(key, df_all))
+    return index.updated(added, removed)
+
+
+def get_date_slices(store, df_all: pd.DataFrame) -> DateSlices:
+    # Built from the cached load; queued writes are overlaid per range.
+    key = frame_key(store, df_all)
+    return get_data_cache().derived(key, "date_slices", df_all, DateSlices)
+
+
+def search_rows(store, df_all: pd.DataFrame, rows: pd.DataFrame, query: str) -> pd.DataFrame:
+    # ``rows`` is a subset of ``df_all``, whose search index is cached.
+    if rows.empty or not query.strip():
+        return rows
+    hits = search_mask(get_search_index(store, df_all), query)
+    return rows[hits.reindex(rows.index, fill_value=False).to_numpy()]
+
+
+def transactions_between(store, df_all: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    # Archived years are only in df_all (the range query sees the hot rows).
+    if store.range_queries and not set(range(start.year, end.year + 1)) & set(archived_years(store)):
+        rows = store.transactions_between(start, end)
+    else:
+        rows = get_date_slices(store, df_all).between(start, end)
+    return write_queue(store).overlay(rows, start, end)
 
 
 # -----------------------------
-# Achievement
+# Exports (built on demand, cached per filter + data version)
 # -----------------------------
-def read_achievement(ws) -> pd.DataFrame:
-    ensure_headers(ws, ACH_HEADERS)
-    rec = ws.get_all_records()
-    df = pd.DataFrame(rec)
-    if df.empty:
-        return df
-    df["year"] = pd.to_numeric(df["year"], errors="coerce").fillna(0).astype(int)
-    df["month"] = pd.to_numeric(df["month"], errors="coerce").fillna(0).astype(int)
-    df["target"] = pd.to_numeric(df["target"], errors="coerce").fillna(0.0)
-    return df
+@st.cache_data(max_entries=16, ttl=CACHE_TTL_SECONDS, show_spinner="กำลังเตรียมไฟล์…")
+def build_export(export_key, fmt: str, _rows: pd.DataFrame) -> bytes:
+    # export_key pins the rows: backend, cached load, queued writes and filter.
+    with stage("export"):
+        return export_bytes(_rows, fmt)
+
+
+def export_download(store, df_all: pd.DataFrame, scope: tuple, rows_fn, fmt: str, file_stem: str, widget_key: str):
+    """A "prepare" button, then a download button for the same file until the data or filter changes.
+
+    ``rows_fn()`` runs only once the user asks for the file.
+    """
+    # Keyed on the queued rows overlaid on this load, not the queue's version
+    # (which also moves on target edits that leave the rows alone).
+    key = frame_key(store, df_all)
+    added, removed = write_queue(store).pending_changes(get_data_cache().base(key, df_all))
+    export_key = (
+        key,
+        df_all.attrs.get("data_version"),
+        tuple(added["id"].astype(int)),
+        tuple(removed.index),
+        scope,
+    )
+    if st.session_state.get(widget_key) != (export_key, fmt):
+        if not st.button(f"เตรียมไฟล์ {fmt.upper()}", key=f"{widget_key}_prepare", use_container_width=True):
+            return
+        st.session_state[widget_key] = (export_key, fmt)
+    rows = rows_fn()
+    if rows.empty:
+        st.warning("ไม่มีข้อมูลให้ Export")
+        return
+    st.download_button(
+        f"Download {fmt.upper()}",
+        data=build_export(export_key, fmt, rows),
+        file_name=f"{file_stem}.{fmt}",
+        mime=EXPORT_FORMATS[fmt],
+        use_container_width=True,
+    )
 
 
-def upsert_target(ws, year: int, month: int, target: float):
-    year = int(year)
-    month = int(month)
-    target = float(target)
+def append_transaction(store, row: dict):
+    write_queue(store).enqueue_append(row)
+
+
+def delete_transactions_by_id(store, target_ids, df_all: pd.DataFrame) -> int:
+    # Queued together, so the worker sends them as one delete_transactions call.
+    if df_all.empty:
+        return 0
+    live = df_all[~is_archived(df_all.index)]  # archived rows are read-only
+    target_ids = [int(i) for i in target_ids if (live["id"] == int(i)).any()]
+    id_index = get_id_index(store, df_all)
+    write_queue(store).enqueue_deletes(target_ids, [id_index.get(i) for i in target_ids])
+    return len(target_ids)
+
+
+def update_transactions(store, edits) -> list:
+    # Written at once rather than queued, so a conflict reaches the person
+    # who made the edit. Labels only differ from the hints when rows moved
+    # under the cache, which is then reloaded instead of patched.
+    labels = store.update_transactions(edits)
+    key = store.cache_key("transactions")
+    if labels != [e["label"] for e in edits]:
+        get_data_cache().invalidate(key)
+        return labels
+    get_data_cache().patch(
+        key, lambda df, state: store.after_update(df, state, edits), removed_labels=labels, added_labels=labels
+    )
+    return labels
 
-    values = ws.get_all_values()
-    if len(values) == 0:
-        ws.append_row(ACH_HEADERS)
-        values = ws.get_all_values()
 
-    for i in range(1, len(values)):
-        row = values[i]
-        if len(row) < 3:
-            continue
+def editor_changes(before: pd.DataFrame, after: pd.DataFrame) -> list:
+    """Edits (see ``update_transactions``) for the cells that differ between two editor frames."""
+    changed = pd.DataFrame(
+        {c: ~((before[c] == after[c]) | (before[c].isna() & after[c].isna())) for c in TX_EDITABLE}
+    )
+    edits = []
+    for label in changed.index[changed.any(axis=1)]:
+        values = {}
+        for col in TX_EDITABLE:
+            if changed.at[label, col]:
+                v = after.at[label, col]
+                if col == "tx_date":
+                    v = v.isoformat() if pd.notna(v) else None
+                elif col in ("qty", "unit_price", "vat_percent"):
+                    v = float(v) if pd.notna(v) else None
+                else:
+                    v = "" if pd.isna(v) else str(v).strip()
+                values[col] = v
+        edits.append(
+            dict(id=int(before.at[label, "id"]), label=label, fingerprint=before.at[label, "_fp"], values=values)
+        )
+    return edits
+
+
+def transaction_editor(store, rows: pd.DataFrame, version):
+    """Editable grid of ``rows``; changed cells of every row are saved in one write."""
+    rows = rows[rows.index >= 0]  # queued (no backend row yet) or archived (read-only)
+    view = rows[["id", *TX_EDITABLE]].copy()
+    view["tx_date"] = view["tx_date"].dt.date
+    for col in view.columns:
+        if col in TX_CATEGORICAL or view[col].dtype == "string":
+            view[col] = view[col].astype(object).where(view[col].notna(), "")
+    view["_fp"] = transaction_fingerprints(rows)
+
+    edited = st.data_editor(
+        view,
+        column_config={
+            "_fp": None,
+            "id": st.column_config.NumberColumn(disabled=True),
+            "tx_date": st.column_config.DateColumn(required=True),
+            "tx_type": st.column_config.SelectboxColumn(options=["Income", "Expense"], required=True),
+            "qty": st.column_config.NumberColumn(min_value=0.0),
+            "unit_price": st.column_config.NumberColumn(min_value=0.0),
+            "vat_percent": st.column_config.NumberColumn(min_value=0.0, max_value=100.0),
+        },
+        hide_index=True,
+        num_rows="fixed",
+        use_container_width=True,
+        key=f"tx_editor_{version}",  # new data starts a fresh set of edits
+    )
+    edits = editor_changes(view, edited)
+    invalid = [
+        e["id"]
+        for e in edits
+        if e["values"].get("tx_date", "") is None
+        or e["values"].get("tx_type", "Income") not in ("Income", "Expense")
+        or any(e["values"].get(c, 0.0) is None for c in ("qty", "unit_price", "vat_percent"))
+    ]
+    st.caption(f"แก้ไขแล้ว {len(edits)} แถว • ID และ created_at ไม่เปลี่ยน")
+    if invalid:
+        st.error(f"กรอกวันที่ / ประเภท / ตัวเลขให้ครบก่อนบันทึก (ID {', '.join(map(str, invalid))})")
+    if st.button("💾 บันทึกการแก้ไข", type="primary", disabled=not edits or bool(invalid)):
         try:
-            y = int(str(row[0]).strip())
-            m = int(str(row[1]).strip())
-        except Exception:
-            continue
-        if y == year and m == month:
-            ws.update_cell(i + 1, 3, target)
+            update_transactions(store, edits)
+        except ConcurrentEditError as e:
+            get_data_cache().invalidate(store.cache_key("transactions"))
+            st.error(
+                f"ID {', '.join(map(str, e.ids))} ถูกแก้ไขหรือลบไปหลังจากที่โหลดมา — ไม่ได้บันทึก "
+                "โหลดข้อมูลล่าสุดแล้ว กรุณาแก้ไขอีกครั้ง"
+            )
             return
+        st.success(f"บันทึกการแก้ไข {len(edits)} รายการแล้ว ✅")
+        st.rerun()
 
-    ws.append_row([year, month, target], value_input_option="USER_ENTERED")
 
+GRID_SORTS = {"วันที่": "tx_date", "ID": "id", "ยอดสุทธิ": "net", "โปรเจกต์": "project", "ผู้ขาย": "vendor"}
+GRID_FILTER_LABELS = {"tx_type": "ประเภท", "category": "หมวด", "project": "โปรเจกต์", "status": "สถานะ"}
+
+
+def transaction_grid(rows: pd.DataFrame, key: str, format_page):
+    """One page of ``rows``: filtered and sorted here, only the visible page is sent to the browser."""
+    g1, g2, g3 = st.columns([1.4, 1.0, 1.0], vertical_alignment="bottom")
+    with g1:
+        sort_label = st.selectbox("เรียงตาม", list(GRID_SORTS), key=f"{key}_sort")
+    with g2:
+        descending = st.toggle("มาก → น้อย", value=True, key=f"{key}_desc")
+    with g3:
+        page_size = st.selectbox("แถวต่อหน้า", PAGE_SIZES, index=1, key=f"{key}_size")
+    with st.expander("ตัวกรองคอลัมน์"):
+        fcols = st.columns(len(FILTER_COLUMNS))
+        filters = {
+            col: fcol.multiselect(GRID_FILTER_LABELS[col], filter_options(rows, col), key=f"{key}_f_{col}")
+            for fcol, col in zip(fcols, FILTER_COLUMNS)
+        }
+
+    with stage("grid"):
+        shown = filter_rows(rows, filters)
+        positions = sort_positions(shown, GRID_SORTS[sort_label], descending)
+    pages = page_count(len(shown), page_size)
+    # A different listing starts again from page 1.
+    listing = hashlib.md5(repr((len(rows), len(shown), sort_label, descending, page_size, filters)).encode()).hexdigest()[:8]
+    page = st.number_input(f"หน้า (จาก {pages:,})", min_value=1, max_value=pages, value=1, key=f"{key}_page_{listing}")
+    first = (page - 1) * page_size
+    st.caption(
+        f"แสดง {min(first + 1, len(shown)):,}–{min(first + page_size, len(shown)):,} จาก {len(shown):,} รายการ"
+        + (f" (ทั้งหมด {len(rows):,})" if len(shown) != len(rows) else "")
+    )
+    st.dataframe(format_page(grid_page(shown, positions, page, page_size)), use_container_width=True, hide_index=True)
 
-def get_targets_for_year(ach_df: pd.DataFrame, year: int):
-    if ach_df.empty:
-        return 0.0, {m: 0.0 for m in range(1, 13)}
 
-    ydf = ach_df[ach_df["year"] == int(year)]
-    yearly = (
-        float(ydf[ydf["month"] == 0]["target"].max())
-        if not ydf[ydf["month"] == 0].empty
-        else 0.0
-    )
+# -----------------------------
+# Achievement
+# -----------------------------
+def upsert_target(store, year: int, month: int, target: float):
+    upsert_targets(store, [(year, month, target)])
+
 
-    monthly = {m: 0.0 for m in range(1, 13)}
-    mdf = ydf[(ydf["month"] >= 1) & (ydf["month"] <= 12)]
-    for _, r in mdf.iterrows():
-        monthly[int(r["month"])] = float(r["target"])
-    return yearly, monthly
+def upsert_targets(store, targets):
+    write_queue(store).enqueue_targets(targets)
 
 
 # -----------------------------
@@ -343,12 +1030,19 @@ with st.sidebar:
     st.markdown('<hr class="soft">', unsafe_allow_html=True)
     nav = st.radio(
         "",
-        ["Dashboard", "Transactions", "Export", "Achievement"],
+        ["Dashboard", "Periods", "Transactions", "Import", "Export", "Achievement"],
         index=0,
         label_visibility="collapsed",
     )
+    if rerun_profile is not None:
+        rerun_profile.page = nav
     st.markdown('<hr class="soft">', unsafe_allow_html=True)
     st.caption("ต้องมีแท็บ: transactions, achievement")
+    if st.button("🔄 โหลดข้อมูลใหม่", use_container_width=True):
+        get_data_cache().invalidate()
+        get_sheets_backend.clear()  # reopen the tabs and re-check their headers
+        get_mirrored_backend.clear()
+        get_entity_backends.clear()
 
 
 # -----------------------------
@@ -364,18 +1058,100 @@ with c3:
 
 start_m, end_m = month_range(month_pick)
 year_selected = month_pick.year
-start_y, end_y = year_range(year_selected)
 month_idx = month_pick.month
 
+# The shell above is already on screen; the data loads below.
+if rerun_profile is not None:
+    rerun_profile.mark_first_paint()
+loading = st.empty()
+loading.caption("⏳ กำลังโหลดข้อมูล…")
+
 
 # -----------------------------
-# Load from Google Sheets
+# Load (Google Sheets or local SQLite)
 # -----------------------------
-_, tx_ws, ach_ws = get_worksheets()
-df_all = read_transactions(tx_ws)
+store = get_storage()
+if store.read_only:
+    if not store.parts:
+        st.error("เปิด Google Sheets ไม่ได้เลยสักไฟล์")
+        for sid, err in store.errors.items():
+            st.caption(f"{sid}: {err}")
+        st.stop()
+    entity = st.sidebar.selectbox("บริษัท", ["รวมทุกบริษัท", *store.parts])
+    if entity != "รวมทุกบริษัท":
+        store = store.parts[entity]
+consolidated = store if store.read_only else None
+# Archived years are read only where the page needs them: Periods compares
+# the picked period with the same period of every year in the ledger, and
+# the import checks duplicates against all of them. Each partition is read
+# once and then cached.
+if nav in ("Periods", "Import"):
+    load_years = archived_years(store)
+else:
+    load_years = [year_selected]
+df_all = load_transactions(store, load_years)
+loading.empty()
+snapshot_keys = [p.cache_key(t) for p in (store.parts.values() if store.read_only else [store]) for t in ("transactions", "achievement")]
+data_as_of = get_data_cache().freshness(snapshot_keys)
+if data_as_of is not None:
+    with loading.container():
+        if data_as_of["revalidating"]:
+            revalidation_badge(snapshot_keys)
+        else:
+            data_as_of_badge(data_as_of)
+if consolidated is not None:
+    for label, err in consolidated.errors.items():
+        st.sidebar.warning(f"โหลด {label} ไม่สำเร็จ (ไม่รวมในยอด): {err}")
+if getattr(store, "mirror_error", None):
+    st.sidebar.warning(f"Mirror to Google Sheets failed: {store.mirror_error}")
+
+with st.sidebar.expander("หน่วยความจำข้อมูล"):
+    mem = get_data_cache().derived(frame_key(store, df_all), "memory_report", df_all, memory_report)
+    st.caption(f"{len(df_all):,} แถว • {mem['bytes'].sum() / 1e6:.1f} MB")
+    st.dataframe(mem, use_container_width=True, hide_index=True)
+
+write_status = write_queue(store).status() if not store.read_only else dict(pending=0, failed=0)
+if write_status["pending"] or write_status["failed"]:
+    with st.sidebar:
+        st.caption(f"⏳ รอบันทึก {write_status['pending']} รายการ • ❌ ไม่สำเร็จ {write_status['failed']} รายการ")
+        if write_status["last_error"]:
+            st.caption(f"ล่าสุด: {write_status['last_error']}")
+        if write_status["failed"]:
+            r1, r2 = st.columns(2)
+            if r1.button("ลองใหม่", use_container_width=True):
+                write_queue(store).retry_failed()
+                st.rerun()
+            if r2.button("ทิ้ง", use_container_width=True):
+                write_queue(store).discard_failed()
+                st.rerun()
 
-if add_sample:
-    nid = next_id(df_all)
+if store.archive is not None:
+    with st.sidebar.expander("🗄️ เก็บถาวรปีที่ปิดแล้ว"):
+        hot_years = closed_years(df_all[df_all.index >= 0], date.today().year)
+        cold_years = archived_years(store)
+        if cold_years:
+            st.caption("เก็บแล้ว: " + ", ".join(str(y) for y in cold_years))
+        if not hot_years:
+            st.caption("ไม่มีปีเก่าค้างอยู่ในชีทหลัก")
+        for y, n in hot_years.items():
+            # Labels of queued deletes would shift under the move: wait for the queue.
+            if st.button(f"ย้ายปี {y} ({n:,} รายการ)", key=f"archive_{y}", disabled=bool(write_status["pending"])):
+                try:
+                    moved = archive_year(store, store.archive, df_all, y)
+                except Exception as e:
+                    st.error(f"เก็บปี {y} ไม่สำเร็จ: {e}")
+                else:
+                    cache = get_data_cache()
+                    cache.invalidate(store.cache_key("transactions"))
+                    cache.invalidate(("archive", store.archive.key(), "years"))
+                    cache.invalidate(("archive", store.archive.key(), y))
+                    st.success(f"ย้าย {moved:,} รายการของปี {y} แล้ว ✅")
+                    st.rerun()
+
+if add_sample and store.read_only:
+    st.warning(READ_ONLY_NOTE)
+elif add_sample:
+    nid = store.allocate_ids(2)[0]
     demo = [
         dict(
             id=nid,
@@ -411,64 +1187,36 @@ if add_sample:
         ),
     ]
     for r in demo:
-        append_transaction(tx_ws, r)
+        append_transaction(store, r)
     st.success("ใส่ข้อมูลตัวอย่างแล้ว ✅")
     st.rerun()
 
 
-def add_net_cols(dfin: pd.DataFrame) -> pd.DataFrame:
-    if dfin.empty:
-        return dfin
-    d = dfin.copy()
-    d["base"], d["vat"], d["net"] = zip(
-        *d.apply(lambda r: calc_amount(r["qty"], r["unit_price"], r["vat_percent"]), axis=1)
-    )
-    return d
-
-
 # Month view
-if df_all.empty:
-    df = df_all
-else:
-    df = df_all.copy()
-    df = df[(df["tx_date"].dt.date >= start_m) & (df["tx_date"].dt.date <= end_m)]
-    if search.strip():
-        s = search.strip().lower()
-
-        def match_row(r):
-            blob = " ".join(
-                [
-                    str(r.get("project", "")),
-                    str(r.get("category", "")),
-                    str(r.get("vendor", "")),
-                    str(r.get("description", "")),
-                    str(r.get("ref", "")),
-                ]
-            ).lower()
-            return s in blob
-
-        df = df[df.apply(match_row, axis=1)]
-
-df = add_net_cols(df)
-
-# Year view (Jan-Dec)
-if df_all.empty:
-    df_year = df_all
-else:
-    df_year = df_all.copy()
-    df_year = df_year[(df_year["tx_date"].dt.date >= start_y) & (df_year["tx_date"].dt.date <= end_y)]
+with stage("filter"):
+    df = search_rows(store, df_all, transactions_between(store, df_all, start_m, end_m), search)
 
-df_year = add_net_cols(df_year)
+with stage("add_net_cols"):
+    df = add_net_cols(df)
 
-# Sales (Income only)
-sales_month = float(df[df["tx_type"] == "Income"]["net"].sum()) if not df.empty else 0.0
-sales_ytd = float(df_year[df_year["tx_type"] == "Income"]["net"].sum()) if not df_year.empty else 0.0
+# Monthly totals come from the aggregate cube; a search narrows the month
+# to matching rows, so those totals are summed from the filtered view.
+with stage("aggregates"):
+    cube = get_cube(store, df_all)
+
+    # Sales (Income only)
+    if search.strip():
+        sales_month = float(df[df["tx_type"] == "Income"]["net"].sum()) if not df.empty else 0.0
+        total_expense = float(df[df["tx_type"] == "Expense"]["net"].sum()) if not df.empty else 0.0
+    else:
+        sales_month = cube_total(cube, year_selected, month_idx, "Income")
+        total_expense = cube_total(cube, year_selected, month_idx, "Expense")
+    sales_ytd = cube_total(cube, year_selected, tx_type="Income")
 
 # P&L month
 total_income = sales_month
-total_expense = float(df[df["tx_type"] == "Expense"]["net"].sum()) if not df.empty else 0.0
-profit = total_income - total_expense
-margin = (profit / total_income * 100.0) if total_income > 0 else 0.0
+month_kpis = pnl_kpis(total_income, total_expense)
+profit, margin = month_kpis["profit"], month_kpis["margin"]
 
 
 # -----------------------------
@@ -477,12 +1225,11 @@ margin = (profit / total_income * 100.0) if total_income > 0 else 0.0
 annual_target = 0.0
 monthly_targets = {m: 0.0 for m in range(1, 13)}
 
-if ach_ws is not None:
-    ach_df = read_achievement(ach_ws)
+if store.has_achievement:
+    ach_df = load_achievement(store)
     annual_target, monthly_targets = get_targets_for_year(ach_df, year_selected)
 
-default_monthly_target = (annual_target / 12.0) if annual_target > 0 else 0.0
-monthly_target = monthly_targets.get(month_idx, 0.0) or default_monthly_target
+monthly_target = monthly_target_for(annual_target, monthly_targets, month_idx)
 
 
 # -----------------------------
@@ -548,6 +1295,16 @@ if nav == "Dashboard":
     with a2:
         progress_block("ACHIEVEMENT (YEAR)", sales_ytd, annual_target, "ยังขาด")
 
+    if consolidated is not None:
+        st.write("")
+        st.markdown("**แยกตามบริษัท** <span class='small-muted'>(เดือนนี้ + ตั้งแต่ต้นปี)</span>", unsafe_allow_html=True)
+        year_rows = add_net_cols(transactions_between(store, df_all, *year_range(year_selected)))
+        by_entity = pnl_by(df, "source").join(
+            pnl_by(year_rows, "source")[["income", "profit"]].rename(columns={"income": "income_ytd", "profit": "profit_ytd"}),
+            how="outer",
+        ).fillna(0.0)
+        st.dataframe(by_entity.round(0), use_container_width=True)
+
     st.write("")
 
     # Chart + Quick export
@@ -560,40 +1317,36 @@ if nav == "Dashboard":
             unsafe_allow_html=True,
         )
 
-        if df_year.empty:
+        if not (cube["year"] == year_selected).any():
             st.info("ยังไม่มีข้อมูลในปีนี้")
         else:
-            d = df_year.copy()
-            d["month"] = d["tx_date"].dt.month
-            d = d.groupby(["month", "tx_type"], as_index=False)["net"].sum()
-
-            months_df = pd.DataFrame({"month": list(range(1, 13))})
-            inc = d[d["tx_type"] == "Income"][["month", "net"]].rename(columns={"net": "Income"})
-            exp = d[d["tx_type"] == "Expense"][["month", "net"]].rename(columns={"net": "Expense"})
-            m = months_df.merge(inc, on="month", how="left").merge(exp, on="month", how="left").fillna(0.0)
-
-            month_labels = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-            m["month_name"] = m["month"].apply(lambda x: month_labels[int(x) - 1])
-
-            melt = m.melt(
-                id_vars=["month", "month_name"],
-                value_vars=["Income", "Expense"],
-                var_name="metric",
-                value_name="value",
-            )
+            with stage("chart"):
+                import altair as alt  # only the Dashboard draws charts
+
+                m = cube_monthly(cube, year_selected)
+
+                month_labels = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+                m["month_name"] = m["month"].apply(lambda x: month_labels[int(x) - 1])
 
-            chart = (
-                alt.Chart(melt)
-                .mark_line(point=True)
-                .encode(
-                    x=alt.X("month_name:N", sort=month_labels, title=""),
-                    y=alt.Y("value:Q", title=""),
-                    color=alt.Color("metric:N", title=""),
-                    tooltip=["month_name", "metric", alt.Tooltip("value:Q", format=",.0f")],
+                melt = m.melt(
+                    id_vars=["month", "month_name"],
+                    value_vars=["Income", "Expense"],
+                    var_name="metric",
+                    value_name="value",
                 )
-                .properties(height=280)
-            )
-            st.altair_chart(chart, use_container_width=True)
+
+                chart = (
+                    alt.Chart(melt)
+                    .mark_line(point=True)
+                    .encode(
+                        x=alt.X("month_name:N", sort=month_labels, title=""),
+                        y=alt.Y("value:Q", title=""),
+                        color=alt.Color("metric:N", title=""),
+                        tooltip=["month_name", "metric", alt.Tooltip("value:Q", format=",.0f")],
+                    )
+                    .properties(height=280)
+                )
+                st.altair_chart(chart, use_container_width=True)
 
         st.markdown("</div>", unsafe_allow_html=True)
 
@@ -608,15 +1361,8 @@ if nav == "Dashboard":
         if df.empty:
             st.button("Download CSV", use_container_width=True, disabled=True)
         else:
-            out = df.copy()
-            out["tx_date"] = out["tx_date"].dt.date.astype(str)
-            csv_bytes = out.to_csv(index=False).encode("utf-8-sig")
-            st.download_button(
-                "Download CSV",
-                data=csv_bytes,
-                file_name="transactions_export.csv",
-                mime="text/csv",
-                use_container_width=True,
+            export_download(
+                store, df_all, ("month", start_m, search.strip()), lambda: df, "csv", "transactions_export", "quick_export"
             )
 
         st.caption("*เหมาะส่งให้บัญชี หรือทำ Pivot ต่อใน Excel")
@@ -668,8 +1414,10 @@ if nav == "Dashboard":
         with r3[3]:
             submitted = st.form_submit_button("เพิ่มรายการ", type="primary", use_container_width=True)
 
-        if submitted:
-            nid = next_id(df_all)
+        if submitted and store.read_only:
+            st.warning(READ_ONLY_NOTE)
+        elif submitted:
+            nid = store.allocate_ids(1)[0]
             row = dict(
                 id=nid,
                 tx_date=dte.isoformat(),
@@ -686,16 +1434,15 @@ if nav == "Dashboard":
                 ref=ref.strip(),
                 created_at=datetime.now().isoformat(),
             )
-            append_transaction(tx_ws, row)
+            append_transaction(store, row)
             st.success("เพิ่มรายการแล้ว ✅")
             st.rerun()
 
     st.write("")
     st.markdown("**Transactions**")
-    if df.empty:
-        st.caption("0 rows")
-    else:
-        show = df.copy()
+
+    def dashboard_columns(page: pd.DataFrame) -> pd.DataFrame:
+        show = page.copy()
         show["Date"] = show["tx_date"].dt.date.astype(str)
         show["Amount"] = show["base"].round(0).astype(int)
         show["VAT"] = show["vat"].round(0).astype(int)
@@ -714,80 +1461,321 @@ if nav == "Dashboard":
             }
         )
         cols = ["id", "Date", "Project", "Type", "Category", "Vendor", "Description", "Qty", "Unit", "Amount", "VAT", "Net", "Status", "Ref"]
-        st.dataframe(show[cols], use_container_width=True, hide_index=True)
+        if consolidated is not None:
+            cols.insert(1, "source")
+        return show[cols]
+
+    if df.empty:
+        st.caption("0 rows")
+    else:
+        transaction_grid(df, "dash_grid", dashboard_columns)
 
     st.markdown("</div>", unsafe_allow_html=True)
 
 
+elif nav == "Periods":
+    st.markdown("### Periods")
+    st.caption("เทียบรายรับ/รายจ่ายตามช่วงเวลา (MTD / QTD / YTD / 12 เดือนล่าสุด / กำหนดเอง) กับปีก่อน")
+
+    daily = get_daily_totals(store, df_all)
+    as_of = min(end_m, date.today())
+
+    p1, p2 = st.columns([1.2, 2.0], vertical_alignment="center")
+    with p1:
+        kind = st.selectbox("ช่วงเวลา", ["MTD", "QTD", "YTD", "Rolling 12M", "Custom"], index=2)
+    with p2:
+        if kind == "Custom":
+            picked = st.date_input("ตั้งแต่ – ถึง", value=(date(as_of.year, 1, 1), as_of))
+            if len(picked) == 0:
+                st.info("เลือกช่วงวันที่")
+                st.stop()
+            p_start, p_end = picked if len(picked) == 2 else (picked[0], picked[0])
+        else:
+            p_start, p_end = period_range(kind, as_of)
+            st.caption(f"{p_start.isoformat()} – {p_end.isoformat()}")
+
+    one_year = relativedelta(years=1)
+    cur = daily.total(p_start, p_end)
+    prev = daily.total(p_start - one_year, p_end - one_year)
+
+    def yoy(key: str) -> str:
+        if key == "margin":
+            return f"ปีก่อน {prev[key]:.0f}% • {cur[key] - prev[key]:+.0f} pts"
+        if prev[key] == 0:
+            return f"ปีก่อน {money(prev[key])}"
+        return f"ปีก่อน {money(prev[key])} • {(cur[key] - prev[key]) / abs(prev[key]) * 100:+.1f}%"
+
+    cards = [
+        ("INCOME", money(cur["income"]), yoy("income")),
+        ("EXPENSE", money(cur["expense"]), yoy("expense")),
+        ("PROFIT / LOSS", money(cur["profit"]), yoy("profit")),
+        ("PROFIT MARGIN", f"{cur['margin']:.0f}%", yoy("margin")),
+    ]
+    for col, (title, value, sub) in zip(st.columns(4), cards):
+        with col:
+            st.markdown(
+                f"""
+                <div class="card">
+                  <div class="card-title">{title}</div>
+                  <div class="card-value">{value}</div>
+                  <div class="card-sub">{sub}</div>
+                </div>
+                """,
+                unsafe_allow_html=True,
+            )
+
+    st.write("")
+    st.markdown("**ช่วงเดียวกันในแต่ละปี**")
+    span = daily.span()
+    if span is None:
+        st.info("ยังไม่มีข้อมูล")
+    else:
+        # Each year is two prefix-sum lookups, so every year in the ledger is cheap.
+        rows = []
+        for y in range(max(span[1].year, p_end.year), span[0].year - 1, -1):
+            shift = relativedelta(years=p_end.year - y)
+            t = daily.total(p_start - shift, p_end - shift)
+            rows.append(
+                {
+                    "Period": f"{(p_start - shift).isoformat()} – {(p_end - shift).isoformat()}",
+                    "Income": round(t["income"]),
+                    "Expense": round(t["expense"]),
+                    "Profit": round(t["profit"]),
+                    "Margin %": round(t["margin"], 1),
+                }
+            )
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
+
 elif nav == "Transactions":
     st.markdown("### Transactions")
-    st.caption("ดูรายการตามเดือน + ค้นหา และลบรายการที่กรอกผิด (Google Sheets)")
+    st.caption("ดูรายการตามเดือน + ค้นหา แก้ไข และลบรายการที่กรอกผิด (Google Sheets)")
+
+    # Ids are per entity, so they repeat across a consolidated view.
+    dup_ids = [] if store.read_only else get_data_cache().derived(
+        frame_key(store, df_all), "duplicate_ids", df_all, duplicate_ids
+    )
+    if dup_ids:
+        shown_ids = ", ".join(str(i) for i in dup_ids[:20]) + (" …" if len(dup_ids) > 20 else "")
+        st.warning(f"พบ ID ซ้ำในชีท {len(dup_ids)} ค่า: {shown_ids} (ลบตาม ID จะลบแถวแรกที่เจอ)")
+
+    undated = get_date_slices(store, df_all).undated
+    if not undated.empty:
+        with st.expander(f"⚠️ {len(undated)} รายการมีวันที่ไม่ถูกต้อง (ไม่แสดงในรายเดือน/รายปี)"):
+            st.dataframe(
+                undated[["id", "project", "tx_type", "category", "vendor", "description", "ref"]],
+                use_container_width=True,
+                hide_index=True,
+            )
 
     if df.empty:
         st.info("ไม่มีรายการในช่วงที่เลือก")
     else:
-        st.markdown("#### Delete Transaction")
-        id_list = df["id"].astype(int).sort_values(ascending=False).tolist()
+        st.markdown("#### Delete Transactions")
+        archived = is_archived(df.index)
+        if archived.any():
+            st.caption(f"{int(archived.sum()):,} รายการอยู่ในปีที่เก็บถาวรแล้ว (ลบ/แก้ไขไม่ได้)")
+        id_list = df.loc[~archived, "id"].astype(int).sort_values(ascending=False).tolist()
 
-        colA, colB, colC = st.columns([1.2, 1.2, 2.6], vertical_alignment="center")
-        with colA:
-            selected_id = st.selectbox("เลือก ID ที่ต้องการลบ", id_list)
+        colA, colB, colC = st.columns([2.4, 1.2, 1.4], vertical_alignment="center")
         with colB:
-            confirm = st.checkbox("ยืนยันว่าต้องการลบ", value=False)
+            select_all = st.checkbox(f"เลือกทั้งหมดที่แสดง ({len(id_list):,})", value=False)
+        with colA:
+            selected_ids = id_list if select_all else st.multiselect("เลือก ID ที่ต้องการลบ", id_list)
         with colC:
-            st.caption("ลบแล้วกู้คืนไม่ได้ทันที แต่ย้อนจาก Version history ของ Google Sheets ได้")
+            confirm = st.checkbox("ยืนยันว่าต้องการลบ", value=False)
+        st.caption("ลบแล้วกู้คืนไม่ได้ทันที แต่ย้อนจาก Version history ของ Google Sheets ได้")
 
-        preview = df[df["id"].astype(int) == int(selected_id)].head(1)
+        preview = df[df["id"].astype(int).isin(selected_ids)]
         if not preview.empty:
-            p = preview.iloc[0]
-            _, _, net = calc_amount(p.get("qty"), p.get("unit_price"), p.get("vat_percent"))
-            st.write(f"กำลังจะลบ: **{p.get('tx_date').date()} | {p.get('tx_type')} | {p.get('project','')} | Net {money(net)}**")
-
-        if st.button("🗑️ Delete Selected Transaction", type="primary", disabled=not confirm):
-            ok = delete_transaction_by_id(tx_ws, int(selected_id))
-            if ok:
-                st.success(f"ลบรายการ ID={selected_id} เรียบร้อย ✅")
+            st.write(
+                f"กำลังจะลบ: **{len(preview):,} รายการ | Income {money(preview.loc[preview['tx_type'] == 'Income', 'net'].sum())}"
+                f" | Expense {money(preview.loc[preview['tx_type'] == 'Expense', 'net'].sum())}**"
+            )
+            if len(preview) <= 20:
+                st.dataframe(
+                    preview[["id", "tx_date", "tx_type", "project", "vendor", "net"]], use_container_width=True, hide_index=True
+                )
+
+        if store.read_only:
+            st.caption(READ_ONLY_NOTE)
+        delete_clicked = st.button(
+            f"🗑️ Delete {len(selected_ids):,} Selected",
+            type="primary",
+            disabled=not confirm or not selected_ids or store.read_only,
+        )
+        if delete_clicked:
+            deleted = delete_transactions_by_id(store, selected_ids, df_all)
+            if deleted:
+                st.success(f"ลบ {deleted:,} รายการเรียบร้อย ✅")
                 st.rerun()
             else:
                 st.error("ไม่พบรายการนี้ในชีท (อาจถูกลบไปแล้ว)")
 
         st.markdown("---")
-        out = df.copy()
-        out["tx_date"] = out["tx_date"].dt.date.astype(str)
-        out = out.sort_values(["tx_date", "id"], ascending=[False, False])
-        st.dataframe(out, use_container_width=True, hide_index=True)
+        if st.toggle("✏️ แก้ไขรายการ", value=False, disabled=store.read_only):
+            transaction_editor(store, df, (df_all.attrs.get("data_version"), write_queue(store).version()))
+        else:
+            scope_label = st.radio(
+                "ช่วงที่แสดง", ["เดือนที่เลือก", f"ทั้งปี {year_selected}", "ทั้งหมด"], horizontal=True, key="tx_grid_scope"
+            )
+            if scope_label == "เดือนที่เลือก":
+                listing = df
+            else:
+                if scope_label == "ทั้งหมด":
+                    df_all = load_transactions(store, archived_years(store))
+                    listing = df_all[df_all["tx_date"].notna()]
+                else:
+                    listing = transactions_between(store, df_all, *year_range(year_selected))
+                listing = add_net_cols(search_rows(store, df_all, listing, search))
+
+            def listing_columns(page: pd.DataFrame) -> pd.DataFrame:
+                out = page.copy()
+                out["tx_date"] = out["tx_date"].dt.date.astype(str)
+                return out
+
+            transaction_grid(listing, "tx_grid", listing_columns)
+
+
+elif nav == "Import":
+    st.markdown("### Import")
+    st.caption("นำเข้า CSV / XLSX (ไฟล์บัญชี หรือ Statement ธนาคาร) — ข้ามรายการที่ซ้ำกับข้อมูลเดิม (วันที่ + Ref + Net + Vendor)")
+
+    if store.read_only:
+        st.info(READ_ONLY_NOTE)
+        st.stop()
+
+    upload = st.file_uploader("เลือกไฟล์", type=list(IMPORT_FORMATS))
+    i1, i2, i3 = st.columns([1.0, 1.4, 1.6], vertical_alignment="bottom")
+    with i1:
+        dayfirst = st.checkbox("วันที่แบบ วัน/เดือน/ปี", value=True)
+    with i2:
+        default_category = st.text_input("หมวดหมู่ (ถ้าในไฟล์ว่าง)", value="Other")
+    with i3:
+        default_project = st.text_input("Project / Client (ถ้าในไฟล์ว่าง)", value="")
+
+    if upload is None:
+        st.caption(
+            "คอลัมน์ที่รู้จัก: หัวตารางแบบเดียวกับแท็บ transactions หรือ วันที่ / รายละเอียด / "
+            "จำนวนเงิน (ติดลบ = รายจ่าย) หรือ ถอน + ฝาก / เลขที่อ้างอิง"
+        )
+        st.stop()
+
+    defaults = dict(category=default_category.strip(), project=default_project.strip())
+    plan_key = (
+        upload.file_id,
+        dayfirst,
+        tuple(defaults.items()),
+        store.cache_key("transactions"),
+        df_all.attrs.get("data_version"),
+        write_queue(store).version(),
+    )
+    plan = st.session_state.get("import_plan")
+    if plan is None or plan["key"] != plan_key:
+        fmt = upload.name.rsplit(".", 1)[-1].lower()
+        try:
+            with st.spinner("กำลังตรวจไฟล์…"), stage("import_prepare"):
+                accepted, rejected, mapping = prepare_import(
+                    upload, fmt, get_dedupe_index(store, df_all), defaults, dayfirst
+                )
+        except ImportColumnsError as e:
+            st.error(f"ไม่พบคอลัมน์ที่จำเป็น: {', '.join(e.missing)}")
+            st.caption(f"หัวตารางในไฟล์: {', '.join(map(str, e.headers))}")
+            st.stop()
+        finally:
+            upload.seek(0)
+        plan = dict(key=plan_key, accepted=accepted, rejected=rejected, mapping=mapping)
+        st.session_state["import_plan"] = plan
+
+    accepted, rejected = plan["accepted"], plan["rejected"]
+    st.caption("จับคู่คอลัมน์: " + " • ".join(f"{src} → {dst}" for src, dst in plan["mapping"].items()))
+    m1, m2, m3 = st.columns(3)
+    m1.metric("นำเข้าได้", f"{len(accepted):,}")
+    m2.metric("ซ้ำ (ข้าม)", f"{rejected['reason'].str.startswith('duplicate').sum():,}")
+    m3.metric("ข้อมูลไม่ถูกต้อง", f"{(~rejected['reason'].str.startswith('duplicate')).sum():,}")
+
+    if not accepted.empty:
+        preview = accepted.head(200).copy()
+        preview["tx_date"] = preview["tx_date"].dt.date.astype(str)
+        st.dataframe(preview, use_container_width=True)
+    if not rejected.empty:
+        with st.expander(f"รายการที่ไม่นำเข้า ({len(rejected):,}) — index = แถวในไฟล์"):
+            st.dataframe(rejected["reason"].value_counts().rename("rows"), use_container_width=True)
+            st.dataframe(rejected.head(500), use_container_width=True)
+
+    if st.button(f"นำเข้า {len(accepted):,} รายการ", type="primary", disabled=accepted.empty):
+        try:
+            with st.spinner("กำลังบันทึก…"), stage("import_write"):
+                written = write_import(store, accepted)
+        except Exception as e:
+            # Chunks before the failure are in the sheet: reload them and
+            # re-check the file on the next run, so they are skipped as duplicates.
+            get_data_cache().invalidate(store.cache_key("transactions"), full=False)
+            st.session_state.pop("import_plan", None)
+            st.error(f"นำเข้าไม่สำเร็จ ({type(e).__name__}: {e}) — บางส่วนอาจถูกบันทึกแล้ว")
+            st.info("ไฟล์จะถูกตรวจอีกครั้งเมื่อหน้านี้โหลดใหม่ (รีเฟรชหรือกดปุ่มใดก็ได้) รายการที่บันทึกแล้วจะนับเป็นรายการซ้ำและถูกข้าม")
+            st.stop()
+        # Only the appended rows are read back (delta sync).
+        get_data_cache().invalidate(store.cache_key("transactions"), full=False)
+        st.session_state.pop("import_plan", None)
+        st.success(f"นำเข้าแล้ว {written:,} รายการ ✅")
+        st.rerun()
 
 
 elif nav == "Export":
     st.markdown("### Export")
-    st.caption("ดาวน์โหลด CSV ตามเดือน/การค้นหา")
-
-    if df.empty:
-        st.warning("ไม่มีข้อมูลให้ Export")
+    st.caption("ดาวน์โหลด CSV / Parquet / XLSX ตามเดือน+การค้นหา ทั้งปี หรือช่วงวันที่ที่กำหนด")
+
+    e1, e2, e3 = st.columns([1.3, 1.8, 1.0], vertical_alignment="bottom")
+    with e1:
+        scope_kind = st.selectbox("ข้อมูล", ["เดือน + ค้นหา", f"ทั้งปี {year_selected}", "กำหนดช่วงวันที่"])
+    with e2:
+        if scope_kind == "กำหนดช่วงวันที่":
+            picked = st.date_input("ตั้งแต่ – ถึง", value=(date(year_selected, 1, 1), end_m))
+            if len(picked) == 0:
+                st.info("เลือกช่วงวันที่")
+                st.stop()
+            x_start, x_end = picked if len(picked) == 2 else (picked[0], picked[0])
+        elif scope_kind == "เดือน + ค้นหา":
+            x_start, x_end = start_m, end_m
+        else:
+            x_start, x_end = year_range(year_selected)
+    with e3:
+        fmt = st.selectbox("รูปแบบ", list(EXPORT_FORMATS))
+    if scope_kind == "กำหนดช่วงวันที่":
+        df_all = load_transactions(store, range(x_start.year, x_end.year + 1))
+
+    if scope_kind == "เดือน + ค้นหา":
+        scope = ("month", start_m, search.strip())
     else:
-        out = df.copy()
-        out["tx_date"] = out["tx_date"].dt.date.astype(str)
-        csv_bytes = out.to_csv(index=False).encode("utf-8-sig")
-        st.download_button(
-            "Download CSV",
-            data=csv_bytes,
-            file_name="transactions_export.csv",
-            mime="text/csv",
-            use_container_width=True,
-        )
+        scope = ("range", x_start, x_end)
+
+    def export_rows() -> pd.DataFrame:
+        if scope[0] == "month":
+            return df
+        return add_net_cols(transactions_between(store, df_all, x_start, x_end))
+
+    st.caption(f"{x_start.isoformat()} – {x_end.isoformat()}")
+    export_download(
+        store, df_all, scope, export_rows, fmt, f"transactions_{x_start.isoformat()}_{x_end.isoformat()}", "export_page"
+    )
 
 
 elif nav == "Achievement":
     st.markdown("### Achievement")
     st.caption("ตั้งเป้าหมายยอดขายรายปี และ (ถ้าต้องการ) override เป้ารายเดือน")
 
-    if ach_ws is None:
+    if not store.has_achievement:
         st.error("ยังไม่มีแท็บชื่อ `achievement` ใน Google Sheets")
         st.info("ไปที่ Google Sheets → เพิ่ม Sheet ใหม่ → ตั้งชื่อแท็บว่า `achievement` แล้วกลับมารีเฟรชหน้านี้")
         st.stop()
 
-    ensure_headers(ach_ws, ACH_HEADERS)
-    ach_df = read_achievement(ach_ws)
+    ach_df = load_achievement(store)
+    if store.read_only:
+        st.info(READ_ONLY_NOTE)
+        st.markdown("#### เป้าหมายรวมทุกบริษัท")
+        st.dataframe(ach_df[ach_df["year"] == year_selected], use_container_width=True, hide_index=True)
+        st.stop()
 
     year_input = st.number_input("เลือกปีที่ต้องการตั้งเป้า", min_value=2000, max_value=2100, value=int(year_selected), step=1)
     annual, monthly_map = get_targets_for_year(ach_df, int(year_input))
@@ -801,7 +1789,7 @@ elif nav == "Achievement":
         save_year = st.button("บันทึกเป้ารายปี", use_container_width=True)
 
     if save_year:
-        upsert_target(ach_ws, int(year_input), 0, float(annual_new))
+        upsert_target(store, int(year_input), 0, float(annual_new))
         st.success("บันทึกเป้ารายปีแล้ว ✅")
         st.rerun()
 
@@ -824,10 +1812,11 @@ elif nav == "Achievement":
     )
 
     if st.button("บันทึกเป้ารายเดือน", type="primary", use_container_width=True):
+        # Yearly row (month 0) + 12 months in one batched write.
+        targets = [(int(year_input), 0, float(annual_new))]
         for _, r in edited.iterrows():
-            m = int(r["month"])
-            t = float(r["target"] or 0.0)
-            upsert_target(ach_ws, int(year_input), m, t)
+            targets.append((int(year_input), int(r["month"]), float(r["target"] or 0.0)))
+        upsert_targets(store, targets)
         st.success("บันทึกเป้ารายเดือนแล้ว ✅")
         st.rerun()
 
@@ -835,3 +1824,13 @@ elif nav == "Achievement":
     st.markdown("#### ตัวอย่างตามโจทย์")
     st.write(f"- ถ้าตั้งเป้ารายปี {money(10_000_000)} → ค่าเฉลี่ยต่อเดือน {money(10_000_000/12)}")
     st.write("- Dashboard จะแสดงยอดเดือนนี้ / เป้ารายเดือน + ยังขาดอีกเท่าไหร่ + % พร้อม progress bar")
+
+
+# -----------------------------
+# Profiling panel (last, so it sees the whole rerun)
+# -----------------------------
+if rerun_profile is not None:
+    if show_profiling:
+        profiling_panel(rerun_profile)
+    else:
+        get_profiler().finish(rerun_profile)
@@ -0,0 +1,159 @@
+"""Closed years moved out of the hot ledger, one partition per year (no Streamlit imports here).
+
+``ParquetArchive`` keeps a year in a local file (``<dir>/year=YYYY.parquet``),
+``SheetsArchive`` in a ``transactions_YYYY`` worksheet of the same
+spreadsheet. ``archive_year`` copies a year's rows into its partition and
+then deletes them from the backend, so everyday loads only read the hot
+tab. Archived years are closed (nothing edits them), so a loaded partition
+never needs re-reading.
+"""
+
+import glob
+import os
+import re
+
+import pandas as pd
+
+from storage import TX_HEADERS, _pad_rows, coerce_transactions, concat_transactions, parse_transaction_rows
+
+
+ARCHIVE_TAB_PREFIX = "transactions_"
+# Archived rows get index labels at or below this, one block per year, well
+# clear of the backend's labels (>= 0) and the write queue's (-1, -2, ...).
+ARCHIVE_LABEL_MAX = -10**9
+ARCHIVE_LABELS_PER_YEAR = 10**8
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def partition_labels(year: int, n: int) -> pd.Index:
+    top = ARCHIVE_LABEL_MAX - int(year) * ARCHIVE_LABELS_PER_YEAR
+    return pd.RangeIndex(top, top - n, -1)
+
+
+def is_archived(labels):
+    return pd.Index(labels) <= ARCHIVE_LABEL_MAX
+
+
+def _cell_rows(df: pd.DataFrame) -> list:
+    # Cells as they would be typed into the transactions tab.
+    out = df[TX_HEADERS].astype(object)
+    out["tx_date"] = df["tx_date"].dt.strftime("%Y-%m-%d")
+    out["id"] = df["id"].astype("Int64").astype(object)
+    return [["" if pd.isna(v) else v for v in row] for row in out.itertuples(index=False, name=None)]
+
+
+class ParquetArchive:
+    name = "parquet"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def key(self):
+        return (self.name, os.path.abspath(self.directory))
+
+    def _path(self, year: int) -> str:
+        return os.path.join(self.directory, f"year={int(year)}.parquet")
+
+    def years(self) -> list:
+        found = (re.search(r"year=(\d{4})\.parquet$", p) for p in glob.glob(os.path.join(self.directory, "year=*.parquet")))
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def read(self, year: int) -> pd.DataFrame:
+        if not os.path.exists(self._path(year)):
+            return pd.DataFrame(columns=TX_HEADERS)
+        # The file keeps the in-memory dtypes (categories, Arrow strings).
+        return pd.read_parquet(self._path(year))
+
+    def append(self, year: int, df: pd.DataFrame):
+        rows = df[TX_HEADERS]
+        old = self.read(year)
+        if not old.empty:
+            rows = concat_transactions(old, rows)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(year) + ".tmp"
+        rows.reset_index(drop=True).to_parquet(tmp, index=False)
+        os.replace(tmp, self._path(year))
+
+
+class SheetsArchive:
+    name = "sheets"
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def key(self):
+        return (self.name, self.spreadsheet.id)
+
+    def years(self) -> list:
+        titles = (ws.title for ws in self.spreadsheet.worksheets())
+        return sorted(int(t[len(ARCHIVE_TAB_PREFIX):]) for t in titles if re.fullmatch(ARCHIVE_TAB_PREFIX + r"\d{4}", t))
+
+    def read(self, year: int) -> pd.DataFrame:
+        from gspread.exceptions import WorksheetNotFound
+
+        try:
+            ws = self.spreadsheet.worksheet(f"{ARCHIVE_TAB_PREFIX}{int(year)}")
+        except WorksheetNotFound:
+            return pd.DataFrame(columns=TX_HEADERS)
+        return parse_transaction_rows(_pad_rows(ws.get_all_values()[1:], len(TX_HEADERS)))
+
+    def append(self, year: int, df: pd.DataFrame):
+        from gspread.exceptions import WorksheetNotFound
+
+        title = f"{ARCHIVE_TAB_PREFIX}{int(year)}"
+        rows = _cell_rows(df)
+        try:
+            ws = self.spreadsheet.worksheet(title)
+        except WorksheetNotFound:
+            ws = self.spreadsheet.add_worksheet(title, rows=len(rows) + 1, cols=len(TX_HEADERS))
+            rows = [list(TX_HEADERS)] + rows
+        ws.append_rows(rows, value_input_option="USER_ENTERED", table_range="A1")
+
+
+def read_partition(archive, year: int) -> pd.DataFrame:
+    """A year's archived rows, typed like a backend load, with that year's archive labels."""
+    df = archive.read(year)
+    df = coerce_transactions(df) if not df.empty else df
+    df.index = partition_labels(year, len(df))
+    return df
+
+
+def with_partitions(hot: pd.DataFrame, partitions) -> pd.DataFrame:
+    out = hot
+    for part in partitions:
+        if part.empty:
+            continue
+        out = part if out.empty else concat_transactions(out, part)
+    return out
+
+
+def closed_years(df: pd.DataFrame, current_year: int) -> dict:
+    """Years before ``current_year`` still in the hot ledger -> their row count."""
+    if df.empty:
+        return {}
+    years = df["tx_date"].dt.year.dropna().astype(int)
+    counts = years[years < int(current_year)].value_counts().sort_index()
+    return {int(y): int(n) for y, n in counts.items()}
+
+
+def archive_year(store, archive, df: pd.DataFrame, year: int) -> int:
+    """Move ``year``'s rows of ``df`` (the backend's rows as loaded) into ``archive``.
+
+    The partition is written and read back before anything is deleted, so a
+    failure leaves the rows in the hot ledger (at worst, also in the archive).
+    Rows already in the archive (from such a failed run) are not written again.
+    """
+    rows = df[(df["tx_date"].dt.year == int(year)) & (df.index >= 0)]
+    if rows.empty:
+        return 0
+    existing = archive.read(year)
+    new_rows = rows[~rows["id"].isin(existing["id"])]
+    if not new_rows.empty:
+        archive.append(year, new_rows)
+        if len(archive.read(year)) < len(existing) + len(new_rows):
+            raise ArchiveError(f"archive of {year} is missing rows after writing; nothing was deleted")
+    deleted = store.delete_transactions(rows["id"].astype(int).tolist(), [int(i) for i in rows.index])
+    return len(deleted)
@@ -0,0 +1,184 @@
+"""Benchmark the ledger pipeline on synthetic data behind a fake Google Sheet.
+
+    python -m benchmarks.bench_ledger --rows 10000 100000 1000000 --out bench.json
+
+Each size gets a fresh synthetic ``transactions`` tab (skewed projects and
+categories, Thai text, mixed VAT) in a ``FakeSpreadsheet``. Every stage is
+run ``--repeat`` times; the JSON holds min/median seconds and the Sheets
+calls one run of the stage made, so two versions can be diffed.
+"""
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_gspread import FakeSpreadsheet, FakeWorksheet
+from exports import export_bytes
+from grid import grid_page, sort_positions
+from importer import DedupeIndex, prepare_import, write_import
+from pnl_core import DateSlices, add_net_cols, build_cube, build_search_index, cube_monthly, search_mask
+from storage import ACH_HEADERS, TX_HEADERS, SheetsBackend, build_id_index, transaction_fingerprints
+
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+IMPORT_ROWS = 20_000  # size of the statement file imported into each ledger
+FIRST_DAY = date(2021, 1, 1)
+YEARS = 5
+
+CLIENTS = ["บริษัท สยามมีเดีย", "Client A", "ลูกค้า บางกอกฟิล์ม", "Studio Nine", "ห้างหุ้นส่วน ไทยโปรดักชั่น", "Brand X"]
+JOBS = ["TVC", "โฆษณาออนไลน์", "MV", "Corporate Video", "ถ่ายภาพนิ่ง", "Event"]
+EXPENSE_CATEGORIES = ["Crew", "Studio", "Equipment", "Post-Production", "Travel", "Ads", "Other"]
+EXPENSE_WEIGHTS = [0.35, 0.15, 0.2, 0.12, 0.08, 0.06, 0.04]
+VENDORS = ["ร้านเช่ากล้อง", "Freelance DOP", "สตูดิโอ ลาดพร้าว", "Grab", "Facebook Ads", "ช่างไฟ", "Colorist"]
+DESCRIPTIONS = ["ค่าตัวทีมงาน", "เช่าอุปกรณ์ถ่ายทำ", "Milestone payment", "ค่าเดินทาง", "ตัดต่อและทำสี", "ค่าโฆษณา", "มัดจำ"]
+PAYMENTS = ["Bank Transfer", "Cash", "Credit", "Other"]
+STATUSES = ["Planned", "Paid", "Invoiced", "Received"]
+
+
+def synthetic_rows(n: int, seed: int = 7) -> list:
+    """``n`` transaction rows as the strings ``get_all_values`` returns."""
+    rng = np.random.default_rng(seed)
+    projects = np.array([f"{c} - {j} {k}" for c in CLIENTS for j in JOBS for k in range(1, 9)])
+    # Zipf-like skew: a few projects carry most of the rows.
+    project = projects[np.minimum(rng.zipf(1.4, n) - 1, len(projects) - 1)]
+    income = rng.random(n) < 0.2
+    category = np.where(
+        income, "Production Fee", rng.choice(EXPENSE_CATEGORIES, n, p=EXPENSE_WEIGHTS)
+    )
+    days = rng.integers(0, YEARS * 365, n)
+    tx_date = (np.datetime64(FIRST_DAY) + days.astype("timedelta64[D]")).astype(str)
+    qty = rng.integers(1, 6, n)
+    unit_price = np.where(income, rng.integers(20, 400, n) * 1000, rng.integers(5, 300, n) * 100)
+    vat = rng.choice(["0", "7", "7", "7", ""], n)  # blank cells parse as 0
+    ids = np.arange(1, n + 1)
+    ref = np.where(income, np.char.add("INV-", ids.astype(str)), np.where(rng.random(n) < 0.5, np.char.add("RC-", ids.astype(str)), ""))
+    columns = [
+        ids.astype(str),
+        tx_date,
+        project,
+        np.where(income, "Income", "Expense"),
+        category,
+        rng.choice(VENDORS, n),
+        rng.choice(DESCRIPTIONS, n),
+        qty.astype(str),
+        unit_price.astype(str),
+        vat,
+        rng.choice(PAYMENTS, n),
+        rng.choice(STATUSES, n),
+        ref,
+        np.char.add(tx_date, "T09:00:00"),
+    ]
+    return [list(r) for r in zip(*(c.tolist() for c in columns))]
+
+
+def make_backend(n: int, seed: int = 7):
+    sh = FakeSpreadsheet("bench")
+    tx_ws = FakeWorksheet(sh, "transactions", [list(TX_HEADERS)] + synthetic_rows(n, seed))
+    targets = [[str(y), str(m), str(1_000_000 * (m or 12))] for y in range(FIRST_DAY.year, FIRST_DAY.year + YEARS) for m in range(13)]
+    ach_ws = FakeWorksheet(sh, "achievement", [list(ACH_HEADERS)] + targets)
+    return sh, SheetsBackend(tx_ws, ach_ws)
+
+
+def timed(fn, repeat: int, calls):
+    times = []
+    result = None
+    for i in range(repeat):
+        before = dict(calls)
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+        if i == 0:
+            made = {k: v - before.get(k, 0) for k, v in calls.items() if v != before.get(k, 0)}
+    return result, dict(seconds_min=min(times), seconds_median=statistics.median(times), api_calls=made)
+
+
+def bench_size(n: int, repeat: int, seed: int) -> list:
+    sh, store = make_backend(n, seed)
+    month_start, month_end = date(2023, 6, 1), date(2023, 6, 30)
+    year_start, year_end = date(2023, 1, 1), date(2023, 12, 31)
+    results = []
+
+    def stage(name, fn, times=repeat):
+        out, stats = timed(fn, times, sh.calls)
+        results.append(dict(rows=n, stage=name, repeat=times, **stats))
+        return out
+
+    df, _ = stage("read_transactions", lambda: store.sync_transactions())
+    slices = stage("date_slices_build", lambda: DateSlices(df))
+    month = stage("filter_month", lambda: slices.between(month_start, month_end))
+    year = stage("filter_year", lambda: slices.between(year_start, year_end))
+    index = stage("search_index_build", lambda: build_search_index(df))
+    stage("search", lambda: search_mask(index, "ตัดต่อ"))
+    stage("add_net_cols_month", lambda: add_net_cols(month))
+    year_net = stage("add_net_cols_year", lambda: add_net_cols(year))
+    cube = stage("cube_build", lambda: build_cube(df))
+    stage("chart_aggregation", lambda: cube_monthly(cube, year_start.year))
+    stage("export_csv_year", lambda: export_bytes(year_net, "csv"))
+    order = stage("grid_sort_year", lambda: sort_positions(year_net, "net"))
+    stage("grid_page_year", lambda: grid_page(year_net, order, 2, 100))
+    ids = build_id_index(df)
+    last_id = int(df["id"].iloc[-1])
+    stage("find_row_by_id_hinted", lambda: store.find_row_by_id(last_id, ids.get(last_id)))
+    stage("find_row_by_id_scan", lambda: store.find_row_by_id(last_id))
+    stage("upsert_target", lambda: store.upsert_targets([(year_start.year, 6, 1_500_000.0)]))
+    fingerprints = transaction_fingerprints(month)
+    edits = [
+        dict(id=int(month.at[label, "id"]), label=label, fingerprint=None, values={"status": "Paid"})
+        for label in month.index[:50]
+    ]
+    stage("fingerprints_month", lambda: transaction_fingerprints(month))
+    stage("update_batch", lambda: store.update_transactions([dict(e, fingerprint=fingerprints[e["label"]]) for e in edits]), times=1)
+    # Rows of one month scattered through the sheet, as after a bad import (run once: they are gone after).
+    doomed = month["id"].astype(int).tolist()[:200]
+    stage("delete_batch", lambda: store.delete_transactions(doomed), times=1)
+
+    # A file of new rows plus a slice of rows already in the ledger (skipped as duplicates).
+    fresh = pd.DataFrame(synthetic_rows(IMPORT_ROWS, seed + 1), columns=TX_HEADERS)
+    upload = pd.concat([fresh, pd.DataFrame(store.tx_ws.get_all_values()[1 : IMPORT_ROWS // 10 + 1], columns=TX_HEADERS)])
+    csv = upload.drop(columns=["id", "created_at"]).to_csv(index=False).encode("utf-8")
+    dedupe = stage("dedupe_index_build", lambda: DedupeIndex.from_frame(df))
+    accepted, _, _ = stage("import_prepare", lambda: prepare_import(io.BytesIO(csv), "csv", dedupe))
+    stage("import_write", lambda: write_import(store, accepted))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="ledger sizes (up to 5M)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = dict(
+        meta=dict(
+            started_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            python=platform.python_version(),
+            pandas=pd.__version__,
+            numpy=np.__version__,
+            machine=platform.machine(),
+        ),
+        results=[],
+    )
+    for n in args.rows:
+        print(f"{n:,} rows …", file=sys.stderr)
+        report["results"].extend(bench_size(n, args.repeat, args.seed))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""In-process stand-in for the parts of gspread's Spreadsheet/Worksheet that storage.py uses.
+
+Values are kept as the strings Google Sheets returns from ``get_all_values``,
+so parsing costs are the real ones; there is no network, quota or latency.
+Every call is counted in ``FakeSpreadsheet.calls``.
+"""
+
+import collections
+import itertools
+import re
+
+from gspread.cell import Cell
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, numericise_all, rowcol_to_a1, to_records
+from gspread.worksheet import ValueRange
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheet_id: str = "fake"):
+        self.id = spreadsheet_id
+        self.title = spreadsheet_id
+        self.calls = collections.Counter()
+        self._worksheets = {}
+        self._sheet_ids = itertools.count(1)
+        self._revision = 0
+
+    def _touch(self):
+        self._revision += 1
+
+    def worksheet(self, title: str) -> "FakeWorksheet":
+        self.calls["worksheet"] += 1
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, index=None) -> "FakeWorksheet":
+        self.calls["add_worksheet"] += 1
+        ws = FakeWorksheet(self, title, [])
+        self._worksheets[title] = ws
+        self._touch()
+        return ws
+
+    def batch_update(self, body: dict) -> dict:
+        # Only the requests storage.py sends: row deletions, and adding the
+        # id tab together with its first row.
+        self.calls["spreadsheet_batch_update"] += 1
+        for request in body["requests"]:
+            by_id = {ws.id: ws for ws in self._worksheets.values()}
+            if "addSheet" in request:
+                props = request["addSheet"]["properties"]
+                ws = FakeWorksheet(self, props["title"], [])
+                ws.id = props["sheetId"]
+                self._worksheets[props["title"]] = ws
+            elif "updateCells" in request:
+                start = request["updateCells"]["start"]
+                rows = [[next(iter(v["userEnteredValue"].values())) for v in r["values"]] for r in request["updateCells"]["rows"]]
+                ws = by_id[start["sheetId"]]
+                ws._set(rowcol_to_a1(start["rowIndex"] + 1, start["columnIndex"] + 1), rows)
+            else:
+                r = request["deleteDimension"]["range"]
+                del by_id[r["sheetId"]].rows[r["startIndex"] : r["endIndex"]]
+        self._touch()
+        return {"replies": [{} for _ in body["requests"]]}
+
+    def get_lastUpdateTime(self) -> str:
+        self.calls["get_lastUpdateTime"] += 1
+        return str(self._revision)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: FakeSpreadsheet, title: str, rows):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = next(spreadsheet._sheet_ids)
+        self.rows = rows  # list of lists of str, row 1 first
+        spreadsheet._worksheets[title] = self
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    def _count(self, name: str):
+        self.spreadsheet.calls[name] += 1
+
+    def _grid(self, a1: str):
+        # (first row, last row, first col, last col) as 0-based slice bounds.
+        g = a1_range_to_grid_range(a1.split("!")[-1])
+        if "endColumnIndex" not in g:
+            g["endColumnIndex"] = max((len(r) for r in self.rows), default=0)
+        return (
+            g.get("startRowIndex", 0),
+            g.get("endRowIndex", len(self.rows)),
+            g.get("startColumnIndex", 0),
+            g["endColumnIndex"],
+        )
+
+    def _values(self, a1: str, pad: bool = False):
+        r0, r1, c0, c1 = self._grid(a1)
+        out = []
+        for row in self.rows[r0:r1]:
+            cells = row[c0:c1]
+            if pad:
+                cells = cells + [""] * (c1 - c0 - len(cells))
+            out.append(list(cells))
+        while out and not any(out[-1]):
+            out.pop()
+        return out
+
+    def row_values(self, row: int, **kwargs):
+        self._count("row_values")
+        if row > len(self.rows):
+            return []
+        values = list(self.rows[row - 1])
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def col_values(self, col: int, **kwargs):
+        self._count("col_values")
+        values = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def get_all_values(self, **kwargs):
+        self._count("get_all_values")
+        return [list(r) for r in self.rows]
+
+    def get_all_records(self, **kwargs):
+        self._count("get_all_records")
+        if not self.rows:
+            return []
+        return to_records(self.rows[0], [numericise_all(list(r)) for r in self.rows[1:]])
+
+    def get(self, range_name: str = None, pad_values: bool = False, **kwargs) -> ValueRange:
+        self._count("get")
+        values = self._values(range_name, pad=pad_values)
+        return ValueRange.from_json({"range": f"{self.title}!{range_name}", "majorDimension": "ROWS", "values": values})
+
+    def batch_get(self, ranges, **kwargs) -> list:
+        self._count("batch_get")
+        return [
+            ValueRange.from_json({"range": f"{self.title}!{r}", "majorDimension": "ROWS", "values": self._values(r)})
+            for r in ranges
+        ]
+
+    def acell(self, label: str, **kwargs) -> Cell:
+        self._count("acell")
+        values = self._values(label)
+        row, col = _a1_to_rowcol(label)
+        return Cell(row, col, values[0][0] if values and values[0] else "")
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def _set(self, a1: str, values):
+        r0, _, c0, _ = self._grid(a1)
+        for i, new in enumerate(values):
+            while len(self.rows) <= r0 + i:
+                self.rows.append([])
+            row = self.rows[r0 + i]
+            if len(row) < c0 + len(new):
+                row.extend([""] * (c0 + len(new) - len(row)))
+            row[c0 : c0 + len(new)] = [str(v) for v in new]
+
+    def update(self, values=None, range_name: str = None, **kwargs):
+        self._count("update")
+        self._set(range_name, values)
+        self.spreadsheet._touch()
+        return {"updatedRange": f"{self.title}!{range_name}"}
+
+    def batch_update(self, data, **kwargs):
+        self._count("batch_update")
+        for item in data:
+            self._set(item["range"], item["values"])
+        self.spreadsheet._touch()
+        return {"totalUpdatedCells": sum(len(v) for item in data for v in item["values"])}
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        self._count("append_rows")
+        while self.rows and not any(self.rows[-1]):
+            self.rows.pop()
+        first = len(self.rows) + 1
+        self.rows.extend([str(v) for v in row] for row in values)
+        self.spreadsheet._touch()
+        width = max((len(r) for r in values), default=1)
+        last_col = _col_letters(width)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{last_col}{len(self.rows)}"}}
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        self._count("delete_rows")
+        del self.rows[start_index - 1 : (end_index or start_index)]
+        self.spreadsheet._touch()
+
+
+def _col_letters(col: int) -> str:
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _a1_to_rowcol(label: str):
+    m = re.match(r"([A-Za-z]+)(\d+)", label.split("!")[-1])
+    col = 0
+    for ch in m.group(1).upper():
+        col = col * 26 + ord(ch) - 64
+    return int(m.group(2)), col
@@ -0,0 +1,72 @@
+"""Transaction exports as CSV, Parquet or XLSX (no Streamlit imports here).
+
+Files are written chunk by chunk, so only one chunk is ever converted
+(date formatting, type casts) at a time next to the output buffer.
+"""
+
+import codecs
+import io
+import math
+
+import pandas as pd
+
+
+EXPORT_CHUNK_ROWS = 50_000
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def _chunks(df: pd.DataFrame, size: int):
+    for i in range(0, max(len(df), 1), size):
+        yield df.iloc[i : i + size]
+
+
+def _dates_as_text(chunk: pd.DataFrame) -> pd.DataFrame:
+    out = chunk.copy()
+    out["tx_date"] = out["tx_date"].dt.date.astype(str)
+    return out
+
+
+def write_csv(df: pd.DataFrame, f, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    # utf-8 with BOM so Excel opens Thai text correctly.
+    f.write(codecs.BOM_UTF8)
+    for i, chunk in enumerate(_chunks(df, chunk_rows)):
+        f.write(_dates_as_text(chunk).to_csv(index=False, header=i == 0).encode("utf-8"))
+
+
+def write_parquet(df: pd.DataFrame, f, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for chunk in _chunks(df, chunk_rows):
+        # Sheet text columns can mix numbers and strings (numericised "123").
+        chunk = chunk.astype({c: "string" for c in chunk.columns if chunk[c].dtype == object})
+        table = pa.Table.from_pandas(chunk, preserve_index=False, schema=writer.schema if writer else None)
+        if writer is None:
+            writer = pq.ParquetWriter(f, table.schema)
+        writer.write_table(table)
+    writer.close()
+
+
+def write_xlsx(df: pd.DataFrame, f, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)  # rows are streamed out instead of kept as cells
+    ws = wb.create_sheet("transactions")
+    ws.append(list(df.columns))
+    for chunk in _chunks(df, chunk_rows):
+        for row in _dates_as_text(chunk).itertuples(index=False, name=None):
+            ws.append([None if v is pd.NA or (isinstance(v, float) and math.isnan(v)) else v for v in row])
+    wb.save(f)
+
+
+def export_bytes(df: pd.DataFrame, fmt: str) -> bytes:
+    writers = {"csv": write_csv, "parquet": write_parquet, "xlsx": write_xlsx}
+    buf = io.BytesIO()
+    writers[fmt](df, buf)
+    return buf.getvalue()
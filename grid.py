@@ -0,0 +1,62 @@
+"""Paging, sorting and column filters for the transaction listings (no Streamlit imports here).
+
+The whole filtered frame stays on the server: ``sort_positions`` orders it
+with one ``lexsort`` on the typed columns (dates as datetimes, amounts as
+numbers) and ``grid_page`` takes just the rows of the visible page, so the
+browser only ever receives ``page_size`` rows whatever the listing's length.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+PAGE_SIZES = (50, 100, 250, 500)
+# Columns a listing can be filtered on (each a handful of distinct values).
+FILTER_COLUMNS = ("tx_type", "category", "project", "status")
+
+
+def filter_rows(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    """Rows of ``df`` whose column values are among the picked ones (an empty pick keeps all)."""
+    mask = np.ones(len(df), dtype=bool)
+    for col, picked in filters.items():
+        if picked:
+            mask &= df[col].isin(list(picked)).to_numpy()
+    return df if mask.all() else df[mask]
+
+
+def filter_options(df: pd.DataFrame, col: str) -> list:
+    values = df[col].dropna()
+    return sorted(values.unique().tolist(), key=str)
+
+
+def sort_positions(df: pd.DataFrame, by: str, descending: bool = True) -> np.ndarray:
+    """Positions of ``df`` ordered by ``by``, then ``id``; missing values go last either way."""
+    if df.empty:
+        return np.array([], dtype=np.int64)
+    col = df[by]
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.astype(object)
+    missing = col.isna().to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(col):
+        keys = col.to_numpy("datetime64[ns]").view(np.int64)
+    elif pd.api.types.is_numeric_dtype(col):
+        keys = pd.to_numeric(col).to_numpy(dtype=float, na_value=0.0)
+    else:
+        # Text: rank the distinct values once, then sort the integer ranks.
+        keys = pd.factorize(col.fillna("").astype(str), sort=True)[0]
+    ids = pd.to_numeric(df["id"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    if descending:
+        keys, ids = -keys.astype(float), -ids
+    return np.lexsort((ids, keys, missing))
+
+
+def page_count(n: int, page_size: int) -> int:
+    return max(math.ceil(n / page_size), 1)
+
+
+def grid_page(df: pd.DataFrame, positions: np.ndarray, page: int, page_size: int) -> pd.DataFrame:
+    """Rows of page ``page`` (1-based, clamped) in ``positions`` order."""
+    page = min(max(int(page), 1), page_count(len(positions), page_size))
+    return df.take(positions[(page - 1) * page_size : page * page_size])
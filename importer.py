@@ -0,0 +1,288 @@
+"""Bulk import of CSV/XLSX ledgers and bank statements (no Streamlit imports here).
+
+Files are read in chunks. Each chunk is mapped onto ``TX_HEADERS`` and
+validated with column operations, then checked against a ``DedupeIndex``
+of (tx_date, ref, net, vendor) hashes covering the ledger and the rows
+already accepted from the same file. Accepted rows are written with one
+``append_transactions`` call, which the Sheets backend sends as chunked
+``append_rows`` requests.
+"""
+
+import io
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pnl_core import compute_amounts
+from storage import TX_HEADERS
+
+
+IMPORT_CHUNK_ROWS = 5_000
+IMPORT_FORMATS = ("csv", "xlsx")
+
+# Header in the file (lower-cased, trimmed) -> column it fills. Exact
+# TX_HEADERS names always map to themselves.
+COLUMN_ALIASES = {
+    "date": "tx_date",
+    "transaction date": "tx_date",
+    "วันที่": "tx_date",
+    "วันที่ทำรายการ": "tx_date",
+    "project / client": "project",
+    "client": "project",
+    "type": "tx_type",
+    "ประเภท": "tx_type",
+    "หมวดหมู่": "category",
+    "vendor/payee": "vendor",
+    "payee": "vendor",
+    "details": "description",
+    "memo": "description",
+    "คำอธิบาย": "description",
+    "รายละเอียด": "description",
+    "quantity": "qty",
+    "unit": "unit_price",
+    "unit price": "unit_price",
+    "vat": "vat_percent",
+    "vat %": "vat_percent",
+    "ref no.": "ref",
+    "reference": "ref",
+    "เลขที่อ้างอิง": "ref",
+    # Statements: one signed amount, or money in / money out columns.
+    "amount": "amount",
+    "จำนวนเงิน": "amount",
+    "debit": "debit",
+    "withdrawal": "debit",
+    "ถอน": "debit",
+    "credit": "credit",
+    "deposit": "credit",
+    "ฝาก": "credit",
+}
+TX_TYPE_ALIASES = {"income": "Income", "expense": "Expense", "รายรับ": "Income", "รายจ่าย": "Expense"}
+TEXT_COLUMNS = ["project", "category", "vendor", "description", "payment", "status", "ref"]
+
+
+class ImportColumnsError(ValueError):
+    def __init__(self, missing, headers):
+        super().__init__(f"missing column(s) {', '.join(missing)} in: {', '.join(map(str, headers))}")
+        self.missing = missing
+        self.headers = headers
+
+
+def map_columns(headers) -> dict:
+    """File header -> target column, for the headers this importer understands."""
+    mapping = {}
+    for h in headers:
+        key = str(h).strip().lower()
+        target = key if key in TX_HEADERS else COLUMN_ALIASES.get(key)
+        if target is not None and target not in mapping.values():
+            mapping[h] = target
+    targets = set(mapping.values())
+    missing = [] if "tx_date" in targets else ["tx_date"]
+    if not ({"tx_type", "unit_price"} <= targets or targets & {"amount", "debit", "credit"}):
+        missing.append("tx_type + unit_price (or amount / debit / credit)")
+    if missing:
+        raise ImportColumnsError(missing, list(headers))
+    return mapping
+
+
+def read_chunks(f, fmt: str, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """Raw cells of an uploaded file, ``chunk_rows`` rows per DataFrame (header row = columns)."""
+    if fmt == "csv":
+        # utf-8-sig also reads the BOM our own CSV export writes.
+        yield from pd.read_csv(
+            f, dtype=str, keep_default_na=False, encoding="utf-8-sig", skipinitialspace=True, chunksize=chunk_rows
+        )
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(f if hasattr(f, "read") else io.BytesIO(f), read_only=True, data_only=True)
+    rows = wb.worksheets[0].iter_rows(values_only=True)
+    headers = next(rows, None)
+    if headers is None:
+        return
+    headers = [("" if h is None else str(h)) for h in headers]
+    batch = []
+    for row in rows:
+        if any(v not in (None, "") for v in row):
+            batch.append(row[: len(headers)])
+        if len(batch) == chunk_rows:
+            yield pd.DataFrame(batch, columns=headers)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=headers)
+    wb.close()
+
+
+def _numbers(s: pd.Series) -> pd.Series:
+    # "1,234.50", "฿ 99", "" -> float (NaN when unparseable or blank).
+    if pd.api.types.is_numeric_dtype(s.dtype):
+        return s.astype("float64")
+    text = s.astype(object).fillna("").astype(str).str.replace(r"[,\s฿]", "", regex=True)
+    return pd.to_numeric(text.replace("", np.nan), errors="coerce")
+
+
+def _dates(s: pd.Series, dayfirst: bool) -> pd.Series:
+    # ISO text (and Excel dates) in one vectorised pass; only the rest is
+    # parsed element by element.
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return s.dt.normalize()
+    out = pd.to_datetime(s, format="ISO8601", errors="coerce")
+    rest = out.isna() & s.astype(object).notna() & (s.astype(str).str.strip() != "")
+    if rest.any():
+        out[rest] = pd.to_datetime(s[rest].astype(str), format="mixed", dayfirst=dayfirst, errors="coerce")
+    return out.dt.normalize()
+
+
+def normalize_chunk(raw: pd.DataFrame, mapping: dict, defaults: dict = None, dayfirst: bool = True):
+    """``(rows, reasons)``: ``raw`` as TX_HEADERS columns (minus id / created_at), plus ``net``.
+
+    ``reasons`` is empty for valid rows, else why the row is rejected.
+    ``defaults`` fills text columns the file leaves blank (e.g. category).
+    """
+    src = raw[list(mapping)].set_axis(list(mapping.values()), axis=1)
+    out = pd.DataFrame(index=raw.index)
+
+    out["tx_date"] = _dates(src["tx_date"], dayfirst)
+
+    if "tx_type" in src and "unit_price" in src:
+        tx_type = src["tx_type"].astype(object).fillna("").astype(str).str.strip().str.lower().map(TX_TYPE_ALIASES)
+        unit_price = _numbers(src["unit_price"])
+    elif "amount" in src:
+        amount = _numbers(src["amount"])
+        tx_type = pd.Series(np.where(amount < 0, "Expense", "Income"), index=src.index).where(amount.notna())
+        unit_price = amount.abs()
+    else:
+        credit = _numbers(src["credit"]) if "credit" in src else pd.Series(np.nan, index=src.index)
+        debit = _numbers(src["debit"]) if "debit" in src else pd.Series(np.nan, index=src.index)
+        is_credit = credit.fillna(0) > 0
+        tx_type = pd.Series(np.where(is_credit, "Income", "Expense"), index=src.index)
+        unit_price = credit.where(is_credit, debit.abs())
+        tx_type = tx_type.where(unit_price.notna())
+    out["tx_type"] = tx_type
+    out["qty"] = _numbers(src["qty"]).fillna(1.0) if "qty" in src else 1.0
+    out["unit_price"] = unit_price
+    out["vat_percent"] = _numbers(src["vat_percent"]).fillna(0.0) if "vat_percent" in src else 0.0
+
+    for col in TEXT_COLUMNS:
+        text = src[col].astype(object).fillna("").astype(str).str.strip() if col in src else pd.Series("", index=src.index)
+        default = (defaults or {}).get(col, "")
+        out[col] = text.mask(text == "", default) if default else text
+
+    out["net"] = compute_amounts(out["qty"], out["unit_price"], out["vat_percent"])[2]
+    reasons = np.select(
+        [
+            out["tx_date"].isna().to_numpy(),
+            (out["unit_price"].isna() | (out["unit_price"] < 0) | (out["qty"] < 0)).to_numpy(),
+            out["tx_type"].isna().to_numpy(),
+            ((out["vat_percent"] < 0) | (out["vat_percent"] > 100)).to_numpy(),
+        ],
+        ["bad date", "bad amount", "bad type", "bad vat"],
+        default="",
+    )
+    return out, pd.Series(reasons, index=out.index, dtype=object)
+
+
+# -----------------------------
+# Dedupe index
+# -----------------------------
+def dedupe_keys(df: pd.DataFrame, net=None) -> np.ndarray:
+    """uint64 hash of (day, ref, net to 2 dp, vendor) per row; text is trimmed and case-folded."""
+    if df.empty:
+        return np.array([], dtype="uint64")
+    if net is None:
+        net = compute_amounts(df["qty"], df["unit_price"], df["vat_percent"])[2]
+    day = pd.to_datetime(df["tx_date"]).dt.normalize().to_numpy("datetime64[ns]").view("int64")
+
+    def text(col):
+        s = df[col].astype(object)
+        return s.where(s.notna(), "").astype(str).str.strip().str.lower().to_numpy(dtype=object)
+
+    parts = pd.DataFrame({"day": day, "ref": text("ref"), "net": np.round(np.asarray(net, dtype="float64"), 2), "vendor": text("vendor")})
+    return pd.util.hash_pandas_object(parts, index=False).to_numpy()
+
+
+class DedupeIndex:
+    """Multiset of ``dedupe_keys`` hashes for a ledger.
+
+    Counts (not a set) so removing one of two identical rows keeps the other
+    one's key; ``updated`` follows the same add/remove protocol as the cube.
+    """
+
+    def __init__(self, counts: pd.Series):
+        self.counts = counts
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "DedupeIndex":
+        return cls(pd.Series(dedupe_keys(df)).value_counts())
+
+    def updated(self, added=None, removed=None) -> "DedupeIndex":
+        counts = self.counts
+        if added is not None and not added.empty:
+            counts = counts.add(pd.Series(dedupe_keys(added)).value_counts(), fill_value=0)
+        if removed is not None and not removed.empty:
+            counts = counts.sub(pd.Series(dedupe_keys(removed)).value_counts(), fill_value=0)
+            counts = counts[counts > 0]
+        return self if counts is self.counts else DedupeIndex(counts.astype("int64"))
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        return pd.Index(keys).isin(self.counts.index)
+
+
+# -----------------------------
+# Import
+# -----------------------------
+def prepare_import(f, fmt: str, index: DedupeIndex, defaults: dict = None, dayfirst: bool = True, chunk_rows: int = IMPORT_CHUNK_ROWS):
+    """Parse, validate and dedupe an uploaded file.
+
+    Returns ``(accepted, rejected, mapping)``: accepted rows ready for
+    ``write_import``, rejected rows with a ``reason`` column (including
+    "duplicate" for rows already in the ledger and "duplicate in file"),
+    and the header mapping that was used. Rows keep their file row number
+    (header = 1) as the index.
+    """
+    accepted, rejected = [], []
+    seen = pd.Index([], dtype="uint64")
+    mapping = None
+    first_row = 2
+    for raw in read_chunks(f, fmt, chunk_rows):
+        raw.index = pd.RangeIndex(first_row, first_row + len(raw))
+        first_row += len(raw)
+        if mapping is None:
+            mapping = map_columns(raw.columns)
+        rows, reasons = normalize_chunk(raw, mapping, defaults, dayfirst)
+
+        valid = (reasons == "").to_numpy()
+        keys = np.zeros(len(rows), dtype="uint64")
+        keys[valid] = dedupe_keys(rows[valid], rows.loc[valid, "net"])
+        in_ledger = valid & index.contains(keys)
+        in_file = valid & ~in_ledger & (pd.Index(keys).isin(seen) | pd.Series(keys).duplicated().to_numpy())
+        reasons[in_ledger] = "duplicate"
+        reasons[in_file] = "duplicate in file"
+        keep = valid & ~in_ledger & ~in_file
+        seen = seen.append(pd.Index(keys[keep]))
+
+        accepted.append(rows[keep])
+        rejected.append(raw[~keep].assign(reason=reasons[~keep]))
+
+    if mapping is None:
+        raise ImportColumnsError(["tx_date"], [])
+    return pd.concat(accepted), pd.concat(rejected), mapping
+
+
+def import_records(accepted: pd.DataFrame, ids) -> list:
+    """Row dicts for ``append_transactions`` (ISO dates, one ``created_at`` stamp)."""
+    out = accepted.drop(columns="net").copy()
+    out["id"] = list(ids)
+    out["tx_date"] = out["tx_date"].dt.strftime("%Y-%m-%d")
+    out["created_at"] = datetime.now().isoformat()
+    return out[TX_HEADERS].to_dict("records")
+
+
+def write_import(store, accepted: pd.DataFrame) -> int:
+    """Allocate ids and append every accepted row in one backend call."""
+    if accepted.empty:
+        return 0
+    ids = store.allocate_ids(len(accepted))
+    store.append_transactions(import_records(accepted, ids))
+    return len(accepted)
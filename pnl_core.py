@@ -0,0 +1,378 @@
+"""P&L computations shared by the Streamlit app (no Streamlit imports here)."""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+
+# -----------------------------
+# Periods
+# -----------------------------
+def month_range(d: date):
+    start = d.replace(day=1)
+    end = (start + relativedelta(months=1)) - relativedelta(days=1)
+    return start, end
+
+
+def year_range(y: int):
+    return date(y, 1, 1), date(y, 12, 31)
+
+
+def quarter_start(d: date) -> date:
+    return date(d.year, 3 * ((d.month - 1) // 3) + 1, 1)
+
+
+def period_range(kind: str, as_of: date):
+    # Periods end on ``as_of`` (inclusive).
+    if kind == "QTD":
+        return quarter_start(as_of), as_of
+    if kind == "YTD":
+        return date(as_of.year, 1, 1), as_of
+    if kind == "Rolling 12M":
+        return as_of - relativedelta(years=1) + relativedelta(days=1), as_of
+    return as_of.replace(day=1), as_of  # MTD
+
+
+# -----------------------------
+# Targets
+# -----------------------------
+def get_targets_for_year(ach_df: pd.DataFrame, year: int):
+    if ach_df.empty:
+        return 0.0, {m: 0.0 for m in range(1, 13)}
+
+    ydf = ach_df[ach_df["year"] == int(year)]
+    yearly = (
+        float(ydf[ydf["month"] == 0]["target"].max())
+        if not ydf[ydf["month"] == 0].empty
+        else 0.0
+    )
+
+    monthly = {m: 0.0 for m in range(1, 13)}
+    mdf = ydf[(ydf["month"] >= 1) & (ydf["month"] <= 12)]
+    for _, r in mdf.iterrows():
+        monthly[int(r["month"])] = float(r["target"])
+    return yearly, monthly
+
+
+def monthly_target_for(annual: float, monthly: dict, month: int) -> float:
+    # A month without its own target gets 1/12 of the yearly one.
+    default = (annual / 12.0) if annual > 0 else 0.0
+    return monthly.get(month, 0.0) or default
+
+
+def consolidate_targets(ach_frames) -> pd.DataFrame:
+    """Achievement rows summing several entities' targets.
+
+    Each entity's effective monthly target (its own, or 1/12 of its yearly
+    one) is summed, so the consolidated month matches the entity dashboards.
+    """
+    years = sorted({int(y) for a in ach_frames if not a.empty for y in a["year"].unique()})
+    rows = []
+    for y in years:
+        per_entity = [get_targets_for_year(a, y) for a in ach_frames]
+        rows.append((y, 0, sum(annual for annual, _ in per_entity)))
+        for m in range(1, 13):
+            rows.append((y, m, sum(monthly_target_for(annual, monthly, m) for annual, monthly in per_entity)))
+    return pd.DataFrame(rows, columns=["year", "month", "target"])
+
+
+def pnl_kpis(income: float, expense: float) -> dict:
+    profit = income - expense
+    margin = (profit / income * 100.0) if income > 0 else 0.0
+    return dict(income=income, expense=expense, profit=profit, margin=margin)
+
+
+# -----------------------------
+# Amounts (base / vat / net)
+# -----------------------------
+def _amount_array(values) -> np.ndarray:
+    # Same coercion as float(x or 0): None/""/0 -> 0.0, NaN stays NaN.
+    if isinstance(values, pd.Series):
+        if pd.api.types.is_extension_array_dtype(values.dtype) and pd.api.types.is_numeric_dtype(values.dtype):
+            return values.to_numpy(dtype="float64", na_value=np.nan)
+        values = values.to_numpy()
+    arr = np.asarray(values)
+    if arr.dtype.kind in "biuf":
+        return arr.astype("float64", copy=False)
+    flat = [float(v or 0) for v in arr.ravel()]
+    return np.array(flat, dtype="float64").reshape(arr.shape)
+
+
+def compute_amounts(qty, unit_price, vat_percent):
+    """Columnar calc_amount: scalars or arrays in, float64 (base, vat, net) out."""
+    base = _amount_array(qty) * _amount_array(unit_price)
+    vat = base * (_amount_array(vat_percent) / 100.0)
+    net = base + vat
+    return base, vat, net
+
+
+def calc_amount(qty, unit_price, vat_percent):
+    base, vat, net = compute_amounts(qty, unit_price, vat_percent)
+    return float(base), float(vat), float(net)
+
+
+def add_net_cols(dfin: pd.DataFrame) -> pd.DataFrame:
+    if dfin.empty:
+        return dfin
+    d = dfin.copy()
+    d["base"], d["vat"], d["net"] = compute_amounts(d["qty"], d["unit_price"], d["vat_percent"])
+    return d
+
+
+# -----------------------------
+# Date ranges
+# -----------------------------
+class DateSlices:
+    """Rows sorted by ``tx_date`` so a date range is two binary searches.
+
+    ``between`` returns a positional slice of the sorted frame (no per-row
+    date conversion, no copy). Rows whose ``tx_date`` did not parse (NaT)
+    are kept apart in ``undated`` instead of vanishing from every view.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        if df.empty:
+            self.sorted = self.undated = df
+            self._keys = np.array([], dtype="datetime64[ns]")
+            return
+        dated = df["tx_date"].notna().to_numpy()
+        self.undated = df[~dated]
+        d = df[dated]
+        keys = d["tx_date"].to_numpy()
+        order = np.argsort(keys, kind="stable")  # stable: same-day rows keep sheet order
+        self.sorted = d.take(order)
+        self._keys = keys[order]
+
+    def between(self, start: date, end: date) -> pd.DataFrame:
+        """Rows with ``start <= tx_date < end + 1 day``."""
+        lo = self._keys.searchsorted(np.datetime64(start, "ns"), side="left")
+        hi = self._keys.searchsorted(np.datetime64(end + timedelta(days=1), "ns"), side="left")
+        return self.sorted.iloc[lo:hi]
+
+
+# -----------------------------
+# Period totals (prefix sums)
+# -----------------------------
+def _daily_net(df: pd.DataFrame, tx_type: str):
+    # (day numbers, net) of dated rows of one tx_type; NaN nets count as 0 like .sum().
+    d = df[df["tx_date"].notna().to_numpy() & (df["tx_type"] == tx_type).to_numpy()]
+    days = d["tx_date"].to_numpy().astype("datetime64[D]").astype("int64")
+    _, _, net = compute_amounts(d["qty"], d["unit_price"], d["vat_percent"])
+    return days, np.nan_to_num(net)
+
+
+class DailyTotals:
+    """Cumulative daily income/expense net, so any date range sums in O(1).
+
+    ``income[i]`` / ``expense[i]`` are the totals of day ``origin + i``;
+    the prefix sums are built once, after which ``total(start, end)`` is two
+    lookups per series whatever the length of the range.
+    """
+
+    def __init__(self, origin: int, income: np.ndarray, expense: np.ndarray):
+        self.origin = origin  # days since 1970-01-01
+        self.income = income
+        self.expense = expense
+        self._cum_income = np.concatenate(([0.0], np.cumsum(income)))
+        self._cum_expense = np.concatenate(([0.0], np.cumsum(expense)))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "DailyTotals":
+        empty = cls(0, np.zeros(0), np.zeros(0))
+        return empty.updated(added=df)
+
+    def updated(self, added: pd.DataFrame = None, removed: pd.DataFrame = None) -> "DailyTotals":
+        """A copy with the rows of ``added`` counted in and those of ``removed`` taken out."""
+        parts = []
+        for frame, sign in ((added, 1.0), (removed, -1.0)):
+            if frame is not None and not frame.empty:
+                for tx_type in ("Income", "Expense"):
+                    days, net = _daily_net(frame, tx_type)
+                    if len(days):
+                        parts.append((tx_type, days, sign * net))
+        if not parts:
+            return self
+
+        n = len(self.income)
+        lo = min([int(p[1].min()) for p in parts] + ([self.origin] if n else []))
+        hi = max([int(p[1].max()) + 1 for p in parts] + ([self.origin + n] if n else []))
+        income = np.zeros(hi - lo)
+        expense = np.zeros(hi - lo)
+        income[self.origin - lo : self.origin - lo + n] = self.income
+        expense[self.origin - lo : self.origin - lo + n] = self.expense
+        for tx_type, days, net in parts:
+            target = income if tx_type == "Income" else expense
+            np.add.at(target, days - lo, net)
+        return DailyTotals(lo, income, expense)
+
+    def span(self):
+        """First and last day covered, or None when there are no dated rows."""
+        if not len(self.income):
+            return None
+        first = np.datetime64(self.origin, "D").astype(date)
+        return first, first + timedelta(days=len(self.income) - 1)
+
+    def _sum(self, cum: np.ndarray, start: date, end: date) -> float:
+        n = len(cum) - 1
+        i = int(np.datetime64(start, "D").astype("int64")) - self.origin
+        j = int(np.datetime64(end, "D").astype("int64")) - self.origin + 1
+        i, j = min(max(i, 0), n), min(max(j, 0), n)
+        return float(cum[j] - cum[i]) if j > i else 0.0
+
+    def total(self, start: date, end: date) -> dict:
+        """income / expense / profit / margin (%) for ``start..end`` inclusive."""
+        return pnl_kpis(self._sum(self._cum_income, start, end), self._sum(self._cum_expense, start, end))
+
+
+def pnl_by(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    """income / expense / profit / margin per value of ``key`` (rows need ``net``)."""
+    cols = ["income", "expense", "profit", "margin"]
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+    sums = df.pivot_table(index=key, columns="tx_type", values="net", aggfunc="sum", observed=False)
+    sums = sums.reindex(columns=["Income", "Expense"]).fillna(0.0)
+    rows = {k: pnl_kpis(float(r["Income"]), float(r["Expense"])) for k, r in sums.iterrows()}
+    return pd.DataFrame.from_dict(rows, orient="index", columns=cols).rename_axis(key)
+
+
+# -----------------------------
+# Search
+# -----------------------------
+SEARCH_FIELDS = ["project", "category", "vendor", "description", "ref"]
+
+
+def build_search_index(df: pd.DataFrame) -> pd.Series:
+    """Lower-cased "project category vendor description ref" text per row.
+
+    Built once per load and aligned on ``df.index``, so any slice of the same
+    load can be matched with ``search_mask(index, q).loc[slice.index]``.
+    """
+    if df.empty:
+        return pd.Series([], index=df.index, dtype="string[pyarrow]")
+    # Missing values become "" (astype(str) alone would index "<NA>" / "nan").
+    parts = [
+        df[col].astype("string").fillna("") if col in df.columns else pd.Series("", index=df.index)
+        for col in SEARCH_FIELDS
+    ]
+    # Lower-case with Python (same result as before for Thai / mixed scripts),
+    # then hand the text to Arrow so lookups run as one vectorized kernel.
+    blob = parts[0].str.cat(parts[1:], sep=" ").str.lower()
+    return blob.astype("string[pyarrow]")
+
+
+def search_mask(index: pd.Series, query: str) -> pd.Series:
+    s = query.strip().lower()
+    if not s:
+        return pd.Series(True, index=index.index)
+    return index.str.contains(s, regex=False).fillna(False).astype(bool)
+
+
+# -----------------------------
+# Monthly aggregate cube
+# -----------------------------
+CUBE_KEYS = ["year", "month", "tx_type", "category", "project"]
+CUBE_VALUES = ["base", "vat", "net", "rows"]
+_CUBE_DTYPES = dict(
+    year="int64", month="int64", tx_type="object", category="object", project="object",
+    base="float64", vat="float64", net="float64", rows="int64",
+)
+
+
+def _labels(s: pd.Series) -> np.ndarray:
+    # Plain str keys whatever the column dtype (categorical, Arrow string, object).
+    return s.astype(object).fillna("").to_numpy()
+
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """base/vat/net sums and row counts per (year, month, tx_type, category, project).
+
+    Rows without a valid ``tx_date`` are left out, as they are from every
+    date-filtered view. The cube is small (one row per group), so the
+    dashboard reads totals from it instead of re-summing the ledger.
+    """
+    d = df[df["tx_date"].notna()] if not df.empty else df
+    if d.empty:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in _CUBE_DTYPES.items()})
+    base, vat, net = compute_amounts(d["qty"], d["unit_price"], d["vat_percent"])
+    flat = pd.DataFrame(
+        {
+            "year": d["tx_date"].dt.year.to_numpy(),
+            "month": d["tx_date"].dt.month.to_numpy(),
+            "tx_type": _labels(d["tx_type"]),
+            "category": _labels(d["category"]),
+            "project": _labels(d["project"]),
+            "base": base,
+            "vat": vat,
+            "net": net,
+            "rows": 1,
+        }
+    )
+    return flat.groupby(CUBE_KEYS, as_index=False, sort=False)[CUBE_VALUES].sum()
+
+
+def update_cube(cube: pd.DataFrame, added: pd.DataFrame = None, removed: pd.DataFrame = None) -> pd.DataFrame:
+    """``cube`` with the rows of ``added`` counted in and those of ``removed`` taken out."""
+    parts = [cube]
+    if added is not None and not added.empty:
+        parts.append(build_cube(added))
+    if removed is not None and not removed.empty:
+        gone = build_cube(removed)
+        gone[CUBE_VALUES] = -gone[CUBE_VALUES]
+        parts.append(gone)
+    if len(parts) == 1:
+        return cube
+    out = pd.concat(parts, ignore_index=True).groupby(CUBE_KEYS, as_index=False, sort=False)[CUBE_VALUES].sum()
+    return out[out["rows"] != 0].reset_index(drop=True)
+
+
+def cube_total(cube: pd.DataFrame, year: int, month: int = None, tx_type: str = None, value: str = "net") -> float:
+    mask = cube["year"] == int(year)
+    if month is not None:
+        mask &= cube["month"] == int(month)
+    if tx_type is not None:
+        mask &= cube["tx_type"] == tx_type
+    return float(cube.loc[mask, value].sum())
+
+
+def cube_monthly(cube: pd.DataFrame, year: int, value: str = "net") -> pd.DataFrame:
+    """Jan-Dec frame with one ``value`` column per tx_type ("Income", "Expense")."""
+    ydf = cube[cube["year"] == int(year)]
+    m = ydf.pivot_table(index="month", columns="tx_type", values=value, aggfunc="sum")
+    m = m.reindex(index=range(1, 13), columns=["Income", "Expense"]).fillna(0.0)
+    m.index.name = "month"
+    m.columns.name = None
+    return m.reset_index()
+
+
+# -----------------------------
+# Period reports (month-end / year-end packs)
+# -----------------------------
+def period_report(slices: DateSlices, ach_df: pd.DataFrame, start: date, end: date) -> dict:
+    """The tables of one report: summary, monthly, by_category and transactions.
+
+    ``start..end`` is a calendar month or a calendar year; the target is the
+    same one the dashboard shows for it (yearly, or monthly with the 1/12
+    fallback).
+    """
+    rows = add_net_cols(slices.between(start, end))
+    cube = build_cube(rows)
+    income = cube_total(cube, start.year, tx_type="Income")
+    expense = cube_total(cube, start.year, tx_type="Expense")
+
+    annual, monthly_targets = get_targets_for_year(ach_df, start.year)
+    is_year = (start, end) == year_range(start.year)
+    target = annual if is_year else monthly_target_for(annual, monthly_targets, start.month)
+    summary = dict(period_start=start.isoformat(), period_end=end.isoformat(), rows=len(rows))
+    summary.update(pnl_kpis(income, expense))
+    summary.update(target=target, achievement_pct=(income / target * 100.0) if target > 0 else None)
+
+    months = cube_monthly(cube, start.year)
+    months = months[(months["month"] >= start.month) & (months["month"] <= end.month)].reset_index(drop=True)
+    months["Profit"] = months["Income"] - months["Expense"]
+    by_category = (
+        cube.groupby(["tx_type", "category"], as_index=False)[CUBE_VALUES].sum()
+        .sort_values(["tx_type", "net"], ascending=[False, False], ignore_index=True)
+    )
+    return dict(summary=pd.DataFrame([summary]), monthly=months, by_category=by_category, transactions=rows)
@@ -0,0 +1,163 @@
+"""Month-end / year-end P&L report packs from the command line (no Streamlit).
+
+    python pnl_report.py --sqlite pnl.db --year 2026 --format csv html
+    python pnl_report.py --sheet ID1 --sheet ID2 --credentials sa.json --month 2026-03 --format parquet
+
+Each source (SQLite file or spreadsheet) is read once; the reports are then
+built in a process pool whose workers receive every ledger once, at start-up.
+Output goes to ``OUT/<source>/<period>/`` (summary, monthly, by_category and
+transactions tables, plus ``report.html``).
+"""
+
+import argparse
+import html
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import date
+
+import pandas as pd
+
+from exports import export_bytes
+from pnl_core import DateSlices, month_range, period_report, year_range
+from storage import SheetsBackend, SQLiteBackend
+
+
+REPORT_FORMATS = ["csv", "parquet", "html"]
+TABLES = ["summary", "monthly", "by_category", "transactions"]
+
+
+# -----------------------------
+# Sources
+# -----------------------------
+def _label(text: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", text).strip("_") or "source"
+
+
+def open_sources(args) -> dict:
+    """label -> backend for every --sqlite / --sheet given."""
+    sources = {}
+    for path in args.sqlite:
+        sources[_label(os.path.splitext(os.path.basename(path))[0])] = SQLiteBackend(path)
+    if args.sheet:
+        import gspread
+
+        client = gspread.service_account(filename=args.credentials)
+        for sheet_id in args.sheet:
+            sources[_label(sheet_id)] = SheetsBackend.open(client, sheet_id)
+    return sources
+
+
+def load_ledger(store):
+    df, _ = store.sync_transactions()
+    ach = store.read_achievement() if store.has_achievement else pd.DataFrame(columns=["year", "month", "target"])
+    return df, ach
+
+
+# -----------------------------
+# Workers
+# -----------------------------
+_ledgers = {}  # per worker process: label -> (DateSlices, achievement df)
+
+
+def _init_worker(ledgers: dict):
+    for label, (df, ach) in ledgers.items():
+        _ledgers[label] = (DateSlices(df), ach)
+
+
+def _write_html(report: dict, title: str, path: str):
+    parts = [f"<h1>{html.escape(title)}</h1>"]
+    for name in TABLES:
+        parts.append(f"<h2>{name.replace('_', ' ').title()}</h2>")
+        parts.append(report[name].to_html(index=False, float_format=lambda v: f"{v:,.2f}", na_rep=""))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            "<!doctype html><html><head><meta charset='utf-8'>"
+            f"<title>{html.escape(title)}</title>"
+            "<style>body{font-family:sans-serif}table{border-collapse:collapse;font-size:12px}"
+            "td,th{border:1px solid #ddd;padding:3px 6px;text-align:right}</style>"
+            f"</head><body>{''.join(parts)}</body></html>"
+        )
+
+
+def build_report(label: str, period: str, start: date, end: date, out_dir: str, formats) -> list:
+    slices, ach = _ledgers[label]
+    report = period_report(slices, ach, start, end)
+    target = os.path.join(out_dir, label, period)
+    os.makedirs(target, exist_ok=True)
+    written = []
+    for fmt in formats:
+        if fmt == "html":
+            path = os.path.join(target, "report.html")
+            _write_html(report, f"P&L {label} {period}", path)
+            written.append(path)
+            continue
+        for name in TABLES:
+            path = os.path.join(target, f"{name}.{fmt}")
+            table = report[name]
+            if name == "transactions" and not table.empty:
+                data = export_bytes(table, fmt)
+            elif fmt == "csv":
+                data = table.to_csv(index=False).encode("utf-8-sig")
+            else:
+                data = table.to_parquet(index=False)
+            with open(path, "wb") as f:
+                f.write(data)
+            written.append(path)
+    return written
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def periods(args) -> list:
+    """(name, start, end) for every --year (the year plus its 12 months) and --month."""
+    out = []
+    for y in args.year:
+        out.append((str(y), *year_range(y)))
+        out.extend((f"{y}-{m:02d}", *month_range(date(y, m, 1))) for m in range(1, 13))
+    for ym in args.month:
+        y, m = (int(x) for x in ym.split("-"))
+        out.append((f"{y}-{m:02d}", *month_range(date(y, m, 1))))
+    return list(dict.fromkeys(out))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sqlite", action="append", default=[], metavar="PATH", help="SQLite ledger (repeatable)")
+    parser.add_argument("--sheet", action="append", default=[], metavar="ID", help="spreadsheet id (repeatable)")
+    parser.add_argument("--credentials", help="service-account JSON file, for --sheet")
+    parser.add_argument("--year", action="append", type=int, default=[], help="year-end pack plus 12 month-ends")
+    parser.add_argument("--month", action="append", default=[], metavar="YYYY-MM", help="one month-end pack")
+    parser.add_argument("--format", nargs="+", choices=REPORT_FORMATS, default=["csv", "html"])
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+    if not (args.sqlite or args.sheet):
+        parser.error("give at least one --sqlite or --sheet")
+    if args.sheet and not args.credentials:
+        parser.error("--sheet needs --credentials")
+    if not (args.year or args.month):
+        parser.error("give at least one --year or --month")
+
+    sources = open_sources(args)
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:  # reads are I/O bound
+        loaded = dict(zip(sources, pool.map(load_ledger, sources.values())))
+
+    jobs = [(label, *p) for label in loaded for p in periods(args)]
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(loaded,)) as pool:
+        futures = {pool.submit(build_report, *job, args.out, args.format): job for job in jobs}
+        for fut in as_completed(futures):
+            label, period = futures[fut][:2]
+            try:
+                print(f"{label} {period}: {len(fut.result())} files", file=sys.stderr)
+            except Exception as e:
+                failed += 1
+                print(f"{label} {period}: FAILED {type(e).__name__}: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
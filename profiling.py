@@ -0,0 +1,199 @@
+"""Per-rerun stage timings and Google Sheets API call accounting (no Streamlit imports here).
+
+Code marks stages with ``with stage("name"):``; that is a no-op unless a
+``Profiler.begin`` is active on the current thread. API calls are counted
+by wrapping the gspread client's HTTP layer, per rerun (calls made by the
+rerun's own thread, or by workers it started through ``bind_profile``) and
+per minute (all threads, for the Sheets quota).
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+
+SHEETS_QUOTA_PER_MINUTE = 60  # default Sheets API read quota per user per minute
+HISTORY_RERUNS = 500  # reruns kept in memory for the p50/p95 table
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_stage(name, time.perf_counter() - t0)
+
+
+def bind_profile(fn):
+    """``fn`` crediting its stages and API calls to this thread's rerun, whichever thread runs it."""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, "profile", None)
+        _local.profile = profile
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.profile = previous
+
+    return bound
+
+
+class RerunProfile:
+    def __init__(self, session: str, t0: float = None, cold_start: bool = False):
+        self.session = session
+        self.page = None
+        self.started_at = datetime.now()
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.cold_start = cold_start  # first rerun of the process (imports included)
+        self.first_paint_s = None
+        # Nested stages are counted in both; a stage run by parallel workers
+        # adds up each worker's time.
+        self.stages = collections.defaultdict(float)
+        self.api_calls = collections.Counter()
+        self.finished = False
+        self._lock = threading.Lock()  # worker threads (bind_profile) add to the same rerun
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] += seconds
+
+    def add_call(self, kind: str):
+        with self._lock:
+            self.api_calls[kind] += 1
+
+    def mark_first_paint(self):
+        # The page shell (nav, filter bar) has been sent; data comes after.
+        if self.first_paint_s is None:
+            self.first_paint_s = time.perf_counter() - self.t0
+
+    def record(self, interrupted: bool, calls_last_minute: int) -> dict:
+        return dict(
+            ts=self.started_at.isoformat(timespec="milliseconds"),
+            session=self.session,
+            page=self.page,
+            total_s=round(time.perf_counter() - self.t0, 6),
+            first_paint_s=None if self.first_paint_s is None else round(self.first_paint_s, 6),
+            cold_start=self.cold_start,
+            stages={k: round(v, 6) for k, v in self.stages.items()},
+            api_calls=dict(self.api_calls),
+            api_calls_last_minute=calls_last_minute,
+            interrupted=interrupted,
+        )
+
+
+def _call_kind(method: str, endpoint: str) -> str:
+    # Reads and writes have separate Sheets quotas; Drive calls (revision checks) have their own.
+    if "googleapis.com/drive" in endpoint:
+        return "drive"
+    return "sheets_read" if method.upper() == "GET" else "sheets_write"
+
+
+class Profiler:
+    """Process-wide: rerun history, API call timestamps and the optional JSON-lines log."""
+
+    def __init__(self, log_path: str = None):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._history = collections.deque(maxlen=HISTORY_RERUNS)
+        self._call_times = collections.deque()
+        self._reruns = 0
+
+    # -----------------------------
+    # API calls
+    # -----------------------------
+    def instrument(self, client):
+        """Count every HTTP request a gspread client makes."""
+        http = getattr(client, "http_client", None)
+        if http is None or getattr(http, "_profiled", False):
+            return client
+        request = http.request
+
+        def counted(method, endpoint, *args, **kwargs):
+            self._count_call(_call_kind(method, endpoint))
+            return request(method, endpoint, *args, **kwargs)
+
+        http.request = counted
+        http._profiled = True
+        return client
+
+    def _count_call(self, kind: str):
+        now = time.monotonic()
+        with self._lock:
+            self._call_times.append(now)
+            self._trim(now)
+        profile = getattr(_local, "profile", None)
+        if profile is not None:
+            profile.add_call(kind)
+
+    def _trim(self, now: float):
+        while self._call_times and now - self._call_times[0] > 60:
+            self._call_times.popleft()
+
+    def calls_last_minute(self) -> int:
+        with self._lock:
+            self._trim(time.monotonic())
+            return len(self._call_times)
+
+    # -----------------------------
+    # Reruns
+    # -----------------------------
+    def begin(self, session: str, previous: RerunProfile = None, t0: float = None) -> RerunProfile:
+        """Start profiling this thread's rerun; ``t0`` is when the script started, if earlier than now."""
+        # A rerun cut short by st.stop()/st.rerun() never reached finish().
+        if previous is not None and not previous.finished:
+            self.finish(previous, interrupted=True)
+        with self._lock:
+            cold_start = self._reruns == 0
+            self._reruns += 1
+        profile = RerunProfile(session, t0, cold_start)
+        _local.profile = profile
+        return profile
+
+    def finish(self, profile: RerunProfile, interrupted: bool = False) -> dict:
+        profile.finished = True
+        if getattr(_local, "profile", None) is profile:
+            _local.profile = None
+        record = profile.record(interrupted, self.calls_last_minute())
+        with self._lock:
+            self._history.append(record)
+            if self.log_path:
+                os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    def percentiles(self) -> pd.DataFrame:
+        """p50/p95 seconds per stage over the recent reruns (``total`` = whole rerun, ``first_paint`` = shell drawn)."""
+        with self._lock:
+            history = list(self._history)
+        rows = [
+            (name, seconds)
+            for r in history
+            if not r["interrupted"]
+            for name, seconds in [("total", r["total_s"]), ("first_paint", r["first_paint_s"]), *r["stages"].items()]
+            if seconds is not None
+        ]
+        if not rows:
+            return pd.DataFrame(columns=["stage", "runs", "p50_ms", "p95_ms"])
+        df = pd.DataFrame(rows, columns=["stage", "seconds"])
+        g = df.groupby("stage", sort=False)["seconds"]
+        out = pd.DataFrame(
+            {"runs": g.size(), "p50_ms": g.quantile(0.5) * 1000, "p95_ms": g.quantile(0.95) * 1000}
+        ).round(1)
+        return out.reset_index()
@@ -0,0 +1,65 @@
+"""On-disk snapshots of the last good load of a sheet (no Streamlit imports here).
+
+One Arrow IPC file per cache key, read through a memory map, so a fresh
+process can show the data it had before restarting without a single API
+call. The file carries the load's sync state and the backend revision it
+was read at (Arrow schema metadata), so the app can check it is still
+current with one revision call, or bring it up to date with a delta sync.
+Files are replaced atomically; a missing or unreadable one is just a miss.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+
+SNAPSHOT_META_KEY = b"pnl_snapshot"
+
+
+class SnapshotStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key) -> str:
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}.arrow")
+
+    def save(self, key, df: pd.DataFrame, state, revision):
+        import pyarrow as pa
+
+        try:
+            json.dumps(state)
+        except (TypeError, ValueError):
+            state = None  # not JSON: the first refresh is a full load instead of a delta sync
+        meta = dict(key=repr(key), revision=revision, state=state, saved_at=datetime.now().isoformat(timespec="seconds"))
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SNAPSHOT_META_KEY: json.dumps(meta)})
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)
+
+    def load(self, key):
+        """``(df, meta)`` of the last snapshot of ``key``, or None."""
+        import pyarrow as pa
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+            meta = json.loads(table.schema.metadata[SNAPSHOT_META_KEY])
+            if meta["key"] != repr(key):
+                return None
+            meta["saved_at"] = datetime.fromisoformat(meta["saved_at"])
+            # Text columns come back Arrow-backed, as a load makes them.
+            strings = {pa.string(), pa.large_string()}
+            return table.to_pandas(types_mapper=lambda t: pd.StringDtype("pyarrow") if t in strings else None), meta
+        except Exception:
+            return None
@@ -0,0 +1,1040 @@
+"""Storage backends for the ledger: Google Sheets, local SQLite, or SQLite mirrored to Sheets.
+
+The app talks to a ``StorageBackend``; nothing in here imports Streamlit, so
+the backends can be used (and exercised offline with SQLite) from scripts.
+gspread is imported inside the Sheets code, so SQLite-only use (and the
+app's first paint) does not pay for loading it.
+"""
+
+import random
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from profiling import stage
+
+
+TX_HEADERS = [
+    "id",
+    "tx_date",
+    "project",
+    "tx_type",
+    "category",
+    "vendor",
+    "description",
+    "qty",
+    "unit_price",
+    "vat_percent",
+    "payment",
+    "status",
+    "ref",
+    "created_at",
+]
+# In-memory dtypes of the non-date, non-amount columns. Amounts stay float64
+# so totals come out exactly as before.
+TX_CATEGORICAL = ["tx_type", "category", "payment", "status"]  # a handful of distinct values
+TX_TEXT = ["project", "vendor", "description", "ref", "created_at"]  # Arrow-backed strings
+TX_EDITABLE = [c for c in TX_HEADERS if c not in ("id", "created_at")]  # id and created_at never change
+ACH_HEADERS = ["year", "month", "target"]  # month 0 = yearly target row
+ID_SEQ_TAB = "id_blocks"  # one appended row per block of ID_BLOCK_SIZE transaction ids
+ID_BLOCK_SIZE = 20  # small, so the ids a restart leaves unused stay few
+
+TAIL_CHECK_ROWS = 3  # rows re-read on a delta sync to detect deletes/edits at the end
+APPEND_CHUNK_ROWS = 5_000  # rows per append_rows request, to stay well under the Sheets payload limit
+
+
+class HeaderMismatchError(Exception):
+    def __init__(self, tab: str, headers):
+        super().__init__(f"header row of '{tab}' does not match: {','.join(headers)}")
+        self.tab = tab
+        self.headers = headers
+
+
+class ConcurrentEditError(Exception):
+    """Rows changed (or vanished) since they were read; nothing was written."""
+
+    def __init__(self, ids):
+        super().__init__(f"changed since read: {', '.join(str(i) for i in ids)}")
+        self.ids = ids
+
+
+def transaction_values(row: dict) -> list:
+    return [
+        row["id"],
+        row["tx_date"],
+        row.get("project", ""),
+        row["tx_type"],
+        row.get("category", ""),
+        row.get("vendor", ""),
+        row.get("description", ""),
+        row.get("qty", 1),
+        row.get("unit_price", 0),
+        row.get("vat_percent", 0),
+        row.get("payment", ""),
+        row.get("status", ""),
+        row.get("ref", ""),
+        row.get("created_at", ""),
+    ]
+
+
+def coerce_transactions(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return df
+    df["tx_date"] = pd.to_datetime(df["tx_date"], errors="coerce")
+    for col in ["qty", "unit_price", "vat_percent"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
+    df["id"] = pd.to_numeric(df["id"], errors="coerce").fillna(0).astype("Int64")
+    for col in TX_CATEGORICAL:
+        df[col] = df[col].astype(object).fillna("").astype(str).astype("category")
+    for col in TX_TEXT:
+        # Numericised cells ("123" -> 123) become text again.
+        df[col] = df[col].astype("string[pyarrow]")
+    return df
+
+
+def concat_transactions(first: pd.DataFrame, second: pd.DataFrame) -> pd.DataFrame:
+    """``pd.concat`` that keeps the categorical columns categorical.
+
+    Plain concat falls back to object dtype when the categories differ, so
+    ``second`` is given the union first (and ``first`` only if it lacks some).
+    """
+    first = first.copy(deep=False)
+    second = second.copy(deep=False)
+    for col in TX_CATEGORICAL:
+        if not (isinstance(first[col].dtype, pd.CategoricalDtype) and isinstance(second[col].dtype, pd.CategoricalDtype)):
+            continue
+        cats = first[col].cat.categories.union(second[col].cat.categories, sort=False)
+        if len(cats) != len(first[col].cat.categories):
+            first[col] = first[col].cat.set_categories(cats)
+        second[col] = second[col].cat.set_categories(cats)
+    return pd.concat([first, second])
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Bytes held per column (strings and categories included), largest first."""
+    usage = df.memory_usage(index=False, deep=True)
+    report = pd.DataFrame(
+        {"column": usage.index, "dtype": [str(df[c].dtype) for c in usage.index], "bytes": usage.to_numpy()}
+    )
+    return report.sort_values("bytes", ascending=False, ignore_index=True)
+
+
+def coerce_achievement(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return df
+    df["year"] = pd.to_numeric(df["year"], errors="coerce").fillna(0).astype(int)
+    df["month"] = pd.to_numeric(df["month"], errors="coerce").fillna(0).astype(int)
+    df["target"] = pd.to_numeric(df["target"], errors="coerce").fillna(0.0)
+    return df
+
+
+def parse_transaction_rows(rows) -> pd.DataFrame:
+    # Same numericising get_all_records() applies, so full and delta loads agree.
+    from gspread.utils import numericise_all, to_records
+
+    with stage("parse_transactions"):
+        records = to_records(TX_HEADERS, [numericise_all(r) for r in rows])
+        return coerce_transactions(pd.DataFrame(records))
+
+
+class StorageBackend:
+    """What the app needs from persistence.
+
+    ``sync_transactions(prev)`` returns ``(df, state)``; ``prev`` is the cached
+    ``(df, state)`` a backend may update incrementally, or None for a full
+    read. Backends with ``range_queries`` answer ``transactions_between``
+    with an indexed query; the app filters the loaded DataFrame otherwise.
+    """
+
+    name = ""
+    range_queries = False
+    has_achievement = True
+    read_only = False
+    archive = None  # cold-year partitions (see archive.py), attached by the app
+    remote = False  # reads go over the network (the app keeps an offline snapshot)
+
+    def cache_key(self, tab: str):
+        raise NotImplementedError
+
+    def revision(self):
+        return None
+
+    def sync_transactions(self, prev=None):
+        raise NotImplementedError
+
+    def read_transactions(self) -> pd.DataFrame:
+        df, _ = self.sync_transactions(None)
+        return df
+
+    def transactions_between(self, start: date, end: date) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def read_achievement(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def allocate_ids(self, n: int = 1) -> list:
+        """Reserve ``n`` new transaction ids, unique across concurrent sessions."""
+        raise NotImplementedError
+
+    def append_transaction(self, row: dict):
+        self.append_transactions([row])
+
+    def append_transactions(self, rows):
+        raise NotImplementedError
+
+    def has_transaction(self, target_id: int) -> bool:
+        raise NotImplementedError
+
+    def delete_transaction(self, target_id: int, hint=None):
+        """Delete the first row with ``target_id``; return its DataFrame index label or None.
+
+        ``hint`` is the label the caller expects (see ``build_id_index``); it is
+        verified before use, so a stale hint only costs the normal lookup.
+        """
+        raise NotImplementedError
+
+    def delete_transactions(self, target_ids, hints=None) -> list:
+        """Delete one row per id in ``target_ids`` (an id listed twice deletes two rows).
+
+        Returns the DataFrame index labels that were deleted; ids not found
+        are skipped. ``hints`` is an optional list of labels, as for
+        ``delete_transaction``.
+        """
+        hints = hints or [None] * len(target_ids)
+        labels = [self.delete_transaction(i, h) for i, h in zip(target_ids, hints)]
+        return [label for label in labels if label is not None]
+
+    def transaction_labels(self, target_ids) -> dict:
+        """DataFrame index label -> id of every row whose id is in ``target_ids``."""
+        df = self.read_transactions()
+        found = df[df["id"].isin([int(i) for i in target_ids])]
+        return dict(zip(found.index, found["id"].astype(int)))
+
+    def delete_transaction_by_id(self, target_id: int) -> bool:
+        return self.delete_transaction(target_id) is not None
+
+    def delete_transactions_by_id(self, target_ids) -> int:
+        return len(self.delete_transactions(list(target_ids)))
+
+    def after_delete(self, df: pd.DataFrame, state, labels):
+        """Cached ``(df, state)`` with the deleted rows (``labels``) removed, or None to reload."""
+        return None
+
+    def update_transactions(self, edits) -> list:
+        """Write ``edits`` in one go and return the labels written.
+
+        Each edit is a dict: ``id``, ``label`` (where the caller saw the row,
+        or None), ``fingerprint`` (``transaction_fingerprints`` of that row,
+        or None to skip the check) and ``values`` (changed TX_EDITABLE
+        fields). If any row no longer matches its fingerprint, nothing is
+        written and ``ConcurrentEditError`` lists those ids.
+        """
+        raise NotImplementedError
+
+    def after_update(self, df: pd.DataFrame, state, edits):
+        """Cached ``(df, state)`` with ``edits`` applied (labels do not move)."""
+        return apply_edits(df, edits), state
+
+    def upsert_target(self, year: int, month: int, target: float):
+        self.upsert_targets([(year, month, target)])
+
+    def upsert_targets(self, targets):
+        """Save ``(year, month, target)`` triples in one go (month 0 = yearly)."""
+        raise NotImplementedError
+
+
+def build_id_index(df: pd.DataFrame) -> pd.Series:
+    """id -> DataFrame index label of its first row (what delete_transaction deletes)."""
+    if df.empty:
+        return pd.Series([], dtype="int64")
+    ids = pd.Series(df.index, index=df["id"].to_numpy())
+    return ids[~ids.index.duplicated()]
+
+
+def transaction_fingerprints(df: pd.DataFrame) -> pd.Series:
+    """Hex digest per row of every TX_HEADERS value, as parsed.
+
+    Two reads of an unchanged row give the same digest whichever backend
+    or load path produced them; ``update_transactions`` compares it with
+    the row it is about to overwrite.
+    """
+    if df.empty:
+        return pd.Series([], index=df.index, dtype=object)
+    parts = pd.DataFrame(index=df.index)
+    for col in TX_HEADERS:
+        s = df[col]
+        if col == "tx_date":
+            parts[col] = s.to_numpy("datetime64[ns]").view("int64")
+        elif col in ("qty", "unit_price", "vat_percent"):
+            parts[col] = s.to_numpy(dtype="float64")
+        else:
+            parts[col] = s.astype(object).where(s.notna(), "").astype(str).to_numpy(dtype=object)
+    return pd.util.hash_pandas_object(parts, index=False).map("{:016x}".format)
+
+
+def check_editable(edits):
+    fields = {field for e in edits for field in e["values"]}
+    if not fields <= set(TX_EDITABLE):
+        raise ValueError(f"not editable: {', '.join(sorted(fields - set(TX_EDITABLE)))}")
+
+
+def apply_edits(df: pd.DataFrame, edits) -> pd.DataFrame:
+    """``df`` with each edit's ``values`` written into row ``label`` (row order kept)."""
+    edits = [e for e in edits if e["label"] in df.index]
+    if not edits:
+        return df
+    labels = [e["label"] for e in edits]
+    current = df.loc[labels, TX_HEADERS].astype(object)
+    current["tx_date"] = df.loc[labels, "tx_date"].dt.strftime("%Y-%m-%d")
+    records = [dict(current.loc[e["label"]].to_dict(), **e["values"]) for e in edits]
+    new = coerce_transactions(pd.DataFrame([transaction_values(r) for r in records], columns=TX_HEADERS))
+    new.index = pd.Index(labels)
+    return concat_transactions(df.drop(index=labels), new).loc[df.index]
+
+
+def duplicate_ids(df: pd.DataFrame) -> list:
+    if df.empty:
+        return []
+    ids = df["id"]
+    return sorted(int(i) for i in ids[ids.duplicated()].unique())
+
+
+def target_map(targets) -> dict:
+    # Later triples win, like calling upsert_target in order.
+    return {(int(y), int(m)): float(t) for y, m, t in targets}
+
+
+# -----------------------------
+# Google Sheets
+# -----------------------------
+def _pad_rows(rows, width):
+    return [(list(r) + [""] * width)[:width] for r in rows]
+
+
+def _sync_state(rows, row_count: int, delta: bool = False) -> dict:
+    # The raw last rows are kept (not just a digest) so a local delete can
+    # drop one of them and the state stays valid.
+    k = min(TAIL_CHECK_ROWS, row_count)
+    return dict(row_count=row_count, tail=[list(r) for r in rows[len(rows) - k:]], delta=delta)
+
+
+def _as_int(cell):
+    try:
+        return int(str(cell).strip())
+    except Exception:
+        return None
+
+
+def _id_matches(cell, target_id: int) -> bool:
+    return _as_int(cell) == int(target_id)
+
+
+def row_ranges(rownums) -> list:
+    """Sorted, de-duplicated row numbers as ``(first, last)`` runs, bottom run first.
+
+    Deleting the runs in this order keeps the row numbers of the runs still
+    to go valid.
+    """
+    runs = []
+    for r in sorted(set(rownums)):
+        if runs and r == runs[-1][1] + 1:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    return [tuple(run) for run in reversed(runs)]
+
+
+def ensure_headers(ws, headers):
+    with stage("ensure_headers"):
+        existing = ws.row_values(1)
+        if existing == headers:
+            return
+        if len(existing) == 0:
+            ws.append_row(headers)
+            return
+    raise HeaderMismatchError(ws.title, headers)
+
+
+class IdBlocks:
+    """Transaction ids from a spreadsheet's ``id_blocks`` tab, handed out in blocks.
+
+    Each appended row reserves a block of ``ID_BLOCK_SIZE`` ids; Sheets
+    serialises appends, so every caller's rows are rows nobody else got.
+    Row ``r`` holds ids offset (B1) + (r - 2) * ID_BLOCK_SIZE + 1 onwards.
+    Ids left in the current block serve later calls with no request;
+    otherwise it is one ``append_rows`` (plus the tab lookup on first use).
+    Kept apart from the backend so the app can hold it across reopens of
+    the spreadsheet; ids left when the process ends are never used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ws = None
+        self._offset = None  # B1 of the id tab; written once, when the tab is created
+        self._pool = []  # ids of the last block not handed out yet
+
+    def _worksheet(self, tx_ws):
+        # The handle and offset are looked up once.
+        from gspread.exceptions import WorksheetNotFound
+
+        if self._ws is None:
+            sh = tx_ws.spreadsheet
+            try:
+                ws = sh.worksheet(ID_SEQ_TAB)
+            except WorksheetNotFound:
+                ws = self._create(sh, tx_ws)
+            self._offset = int(ws.acell("B1").value or 0)
+            self._ws = ws
+        return self._ws
+
+    def _create(self, sh, tx_ws):
+        # First use: continue numbering after the largest id in the sheet. The
+        # tab and its B1 are created in one request, so a session that loses
+        # the race finds B1 already set.
+        from gspread.exceptions import APIError
+
+        ids = [_as_int(v) for v in tx_ws.col_values(1)[1:]]
+        start = max((i for i in ids if i is not None), default=0)
+        sheet_id = random.randrange(1, 2**31 - 1)
+        cells = [{"userEnteredValue": {"stringValue": "id_offset"}}, {"userEnteredValue": {"numberValue": start}}]
+        body = {
+            "requests": [
+                {
+                    "addSheet": {
+                        "properties": {
+                            "sheetId": sheet_id,
+                            "title": ID_SEQ_TAB,
+                            "gridProperties": {"rowCount": 1, "columnCount": 2},
+                        }
+                    }
+                },
+                {
+                    "updateCells": {
+                        "start": {"sheetId": sheet_id, "rowIndex": 0, "columnIndex": 0},
+                        "rows": [{"values": cells}],
+                        "fields": "userEnteredValue",
+                    }
+                },
+            ]
+        }
+        try:
+            sh.batch_update(body)
+        except APIError as e:
+            # Another session created it first; anything else (quota,
+            # permissions) is a real failure.
+            if "already exists" not in str(e.error.get("message", "")):
+                raise
+        return sh.worksheet(ID_SEQ_TAB)
+
+    def allocate(self, tx_ws, n: int = 1) -> list:
+        """``n`` new ids for the spreadsheet of ``tx_ws``."""
+        from gspread.utils import a1_range_to_grid_range
+
+        with self._lock:
+            if len(self._pool) < n:
+                ws = self._worksheet(tx_ws)
+                blocks = -(-(n - len(self._pool)) // ID_BLOCK_SIZE)
+                stamp = datetime.now().isoformat()
+                resp = ws.append_rows([[stamp] for _ in range(blocks)], value_input_option="RAW", table_range="A1")
+                updated = resp["updates"]["updatedRange"].split("!")[-1]
+                first_row = a1_range_to_grid_range(updated)["startRowIndex"] + 1
+                first = self._offset + (first_row - 2) * ID_BLOCK_SIZE + 1
+                self._pool += range(first, first + blocks * ID_BLOCK_SIZE)
+            ids, self._pool = self._pool[:n], self._pool[n:]
+        return ids
+
+
+class SheetsBackend(StorageBackend):
+    """gspread worksheets; DataFrame index label ``i`` is sheet row ``i + 2``."""
+
+    name = "sheets"
+    remote = True
+
+    def __init__(self, tx_ws, ach_ws=None, id_blocks=None):
+        self.tx_ws = tx_ws
+        self.ach_ws = ach_ws
+        self.has_achievement = ach_ws is not None
+        self._headers_checked = set()  # tabs whose header row already matched
+        self.id_blocks = id_blocks if id_blocks is not None else IdBlocks()
+
+    def _ensure_headers(self, ws, headers):
+        # Once per backend: the app keeps backends across reruns, so a full
+        # reload does not cost an extra row_values call every time.
+        if ws.title in self._headers_checked:
+            return
+        ensure_headers(ws, headers)
+        self._headers_checked.add(ws.title)
+
+    @classmethod
+    def open(cls, client, spreadsheet_id: str, id_blocks=None) -> "SheetsBackend":
+        """The ``transactions`` tab (required) and ``achievement`` tab (optional) of a spreadsheet."""
+        from gspread.exceptions import WorksheetNotFound
+
+        sh = client.open_by_key(spreadsheet_id)
+        try:
+            ach_ws = sh.worksheet("achievement")
+        except WorksheetNotFound:
+            ach_ws = None
+        return cls(sh.worksheet("transactions"), ach_ws, id_blocks)
+
+    def cache_key(self, tab: str):
+        return (self.name, self.tx_ws.spreadsheet.id, tab)
+
+    def revision(self):
+        try:
+            return self.tx_ws.spreadsheet.get_lastUpdateTime()
+        except Exception:
+            return None
+
+    def sync_transactions(self, prev=None):
+        """Return ``(df, sync_state)`` for the transactions tab.
+
+        With ``prev`` (cached df and its state) only rows appended since then
+        are read; a shorter sheet or a changed tail means rows were deleted or
+        edited, and the whole tab is reloaded instead.
+        """
+        if prev is not None and prev[1] is not None:
+            synced = self._sync_new_rows(*prev)
+            if synced is not None:
+                return synced
+
+        self._ensure_headers(self.tx_ws, TX_HEADERS)
+        rows = _pad_rows(self.tx_ws.get_all_values()[1:], len(TX_HEADERS))
+        return parse_transaction_rows(rows), _sync_state(rows, len(rows))
+
+    def _sync_new_rows(self, df: pd.DataFrame, state: dict):
+        from gspread.utils import rowcol_to_a1
+
+        n = state["row_count"]
+        k = len(state["tail"])
+        if k == 0 and n > 0:
+            return None
+        first = n - k + 2  # sheet row of the first tail row (row 1 is the header)
+        last_col = rowcol_to_a1(1, len(TX_HEADERS)).rstrip("0123456789")
+        rows = _pad_rows(self.tx_ws.get(f"A{first}:{last_col}", pad_values=True), len(TX_HEADERS))
+        if len(rows) < k or rows[:k] != state["tail"]:
+            return None
+
+        new_rows = rows[k:]
+        if not new_rows:
+            return df, dict(state, delta=True)  # still a delta sync: the TTL keeps running
+        new_df = parse_transaction_rows(new_rows)
+        new_df.index = pd.RangeIndex(len(df), len(df) + len(new_df))
+        merged = new_df if df.empty else concat_transactions(df, new_df)
+        return merged, _sync_state(rows, n + len(new_rows), delta=True)
+
+    def allocate_ids(self, n: int = 1) -> list:
+        """Ids from this spreadsheet's ``IdBlocks`` (kept by the app across reopens)."""
+        return self.id_blocks.allocate(self.tx_ws, n)
+
+    def append_transactions(self, rows):
+        values = [transaction_values(r) for r in rows]
+        for i in range(0, len(values), APPEND_CHUNK_ROWS):
+            self.tx_ws.append_rows(values[i : i + APPEND_CHUNK_ROWS], value_input_option="USER_ENTERED")
+
+    def has_transaction(self, target_id: int) -> bool:
+        return self.find_row_by_id(target_id) is not None
+
+    def transaction_labels(self, target_ids) -> dict:
+        # Column A only.
+        wanted = {int(i) for i in target_ids}
+        found = {}
+        for rownum, cell in enumerate(self.tx_ws.col_values(1)[1:], start=2):
+            cell_id = _as_int(cell)
+            if cell_id in wanted:
+                found[rownum - 2] = cell_id
+        return found
+
+    def find_row_by_id(self, target_id: int, hint=None):
+        # A hinted row costs a one-cell read; otherwise scan column A only.
+        if hint is not None and int(hint) >= 0:
+            rownum = int(hint) + 2
+            cell = self.tx_ws.get(f"A{rownum}").first()
+            if _id_matches(cell, target_id):
+                return rownum
+        ids = self.tx_ws.col_values(1)
+        for i in range(1, len(ids)):
+            if _id_matches(ids[i], target_id):
+                return i + 1  # sheet row number
+        return None
+
+    def delete_transaction(self, target_id: int, hint=None):
+        rownum = self.find_row_by_id(target_id, hint)
+        if rownum is None:
+            return None
+        self.tx_ws.delete_rows(rownum)
+        return rownum - 2
+
+    def delete_transactions(self, target_ids, hints=None) -> list:
+        # One read of column A resolves every id, then all rows go in one
+        # batch_update: contiguous rows as one deleteDimension range, bottom
+        # range first so the earlier ones keep their row numbers.
+        if len(target_ids) == 1:
+            label = self.delete_transaction(target_ids[0], (hints or [None])[0])
+            return [] if label is None else [label]
+        rows_by_id = {}
+        for rownum, cell in enumerate(self.tx_ws.col_values(1)[1:], start=2):
+            cell_id = _as_int(cell)
+            if cell_id is not None:
+                rows_by_id.setdefault(cell_id, []).append(rownum)
+        rownums = []
+        for target_id in target_ids:
+            rows = rows_by_id.get(int(target_id))
+            if rows:
+                rownums.append(rows.pop(0))
+        if not rownums:
+            return []
+        sheet_id = self.tx_ws.id
+        requests = [
+            {
+                "deleteDimension": {
+                    "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last}
+                }
+            }
+            for first, last in row_ranges(rownums)
+        ]
+        self.tx_ws.spreadsheet.batch_update({"requests": requests})
+        return sorted(r - 2 for r in rownums)
+
+    def update_transactions(self, edits) -> list:
+        # One batch_get of the rows at their hinted positions (plus a column A
+        # scan only if a hint went stale), then one batch_update of just the
+        # changed cells. Sheets has no transactions, so a write landing
+        # between the two calls is not caught.
+        from gspread.utils import rowcol_to_a1
+
+        check_editable(edits)
+        rownums = [None if e["label"] is None or e["label"] < 0 else int(e["label"]) + 2 for e in edits]
+        rows = self._rows_at([r for r in rownums if r is not None])
+        stale = [i for i, (r, e) in enumerate(zip(rownums, edits)) if r is None or not _id_matches(rows[r][0], e["id"])]
+        if stale:
+            taken = {r for i, r in enumerate(rownums) if r is not None and i not in stale}
+            rows_by_id = {}
+            for rownum, cell in enumerate(self.tx_ws.col_values(1)[1:], start=2):
+                if rownum not in taken and _as_int(cell) is not None:
+                    rows_by_id.setdefault(_as_int(cell), []).append(rownum)
+            for i in stale:
+                candidates = rows_by_id.get(int(edits[i]["id"]))
+                rownums[i] = candidates.pop(0) if candidates else None
+            rows.update(self._rows_at([rownums[i] for i in stale if rownums[i] is not None]))
+
+        found = [(r, e) for r, e in zip(rownums, edits) if r is not None]
+        conflicts = [e["id"] for r, e in zip(rownums, edits) if r is None]
+        if found:
+            current = transaction_fingerprints(parse_transaction_rows([rows[r] for r, _ in found]))
+            conflicts += [
+                e["id"] for (_, e), fp in zip(found, current) if e["fingerprint"] is not None and fp != e["fingerprint"]
+            ]
+        if conflicts:
+            raise ConcurrentEditError(conflicts)
+
+        cells = [
+            {"range": rowcol_to_a1(r, TX_HEADERS.index(field) + 1), "values": [[value]]}
+            for r, e in found
+            for field, value in e["values"].items()
+        ]
+        if cells:
+            self.tx_ws.batch_update(cells, value_input_option="USER_ENTERED")
+        return [r - 2 for r, _ in found]
+
+    def _rows_at(self, rownums) -> dict:
+        # Whole rows by sheet row number, in one request.
+        from gspread.utils import rowcol_to_a1
+
+        if not rownums:
+            return {}
+        last_col = rowcol_to_a1(1, len(TX_HEADERS)).rstrip("0123456789")
+        ranges = self.tx_ws.batch_get([f"A{r}:{last_col}{r}" for r in rownums])
+        return {r: _pad_rows(v or [[]], len(TX_HEADERS))[0] for r, v in zip(rownums, ranges)}
+
+    def after_delete(self, df: pd.DataFrame, state, labels):
+        # Rows below a deleted one move up, so labels are renumbered; the
+        # sync state shrinks by the number of rows deleted.
+        labels = set(labels)
+        if not pd.Index(list(labels)).isin(df.index).all():
+            return None
+        out = df.drop(index=list(labels))
+        out.index = pd.RangeIndex(len(out))
+        if state is None:
+            return out, None
+        n = state["row_count"]
+        tail_start = n - len(state["tail"])
+        tail = [list(r) for i, r in enumerate(state["tail"], start=tail_start) if i not in labels]
+        return out, dict(state, row_count=n - len(labels), tail=tail)
+
+    def read_achievement(self) -> pd.DataFrame:
+        self._ensure_headers(self.ach_ws, ACH_HEADERS)
+        return coerce_achievement(pd.DataFrame(self.ach_ws.get_all_records()))
+
+    def upsert_targets(self, targets):
+        # One read, then one batch_update for existing rows and at most one
+        # append_rows for new ones (instead of read + write per target).
+        ws = self.ach_ws
+        pending = target_map(targets)
+        if not pending:
+            return
+
+        values = ws.get_all_values()
+        updates = []
+        for i in range(1, len(values)):
+            row = values[i]
+            if len(row) < 3:
+                continue
+            try:
+                key = (int(str(row[0]).strip()), int(str(row[1]).strip()))
+            except Exception:
+                continue
+            if key in pending:
+                updates.append({"range": f"C{i + 1}", "values": [[pending.pop(key)]]})
+
+        if updates:
+            ws.batch_update(updates, value_input_option="USER_ENTERED")
+        new_rows = [[y, m, t] for (y, m), t in pending.items()]
+        if len(values) == 0:
+            new_rows.insert(0, ACH_HEADERS)
+        if new_rows:
+            ws.append_rows(new_rows, value_input_option="USER_ENTERED")
+
+
+# -----------------------------
+# Local SQLite
+# -----------------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER,
+    tx_date TEXT,
+    project TEXT,
+    tx_type TEXT,
+    category TEXT,
+    vendor TEXT,
+    description TEXT,
+    qty REAL,
+    unit_price REAL,
+    vat_percent REAL,
+    payment TEXT,
+    status TEXT,
+    ref TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_transactions_tx_date ON transactions (tx_date);
+CREATE INDEX IF NOT EXISTS ix_transactions_id ON transactions (id);
+CREATE TABLE IF NOT EXISTS achievement (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    target REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (year, month)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('next_id', 1);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded ledger in one SQLite file.
+
+    Rows keep their ``rowid`` as the DataFrame index, so range-query results
+    line up with the full load (and anything derived from it, e.g. search).
+    ``tx_date`` is stored as ISO text, which makes the date index usable for
+    month/year ranges.
+    """
+
+    name = "sqlite"
+    range_queries = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._write_lock = threading.Lock()
+        with self._connect() as con:
+            con.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _bump_revision(self, con):
+        con.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+
+    def cache_key(self, tab: str):
+        return (self.name, self.path, tab)
+
+    def revision(self):
+        with self._connect() as con:
+            return con.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def _query_transactions(self, where: str = "", params=()) -> pd.DataFrame:
+        sql = f"SELECT rowid, {', '.join(TX_HEADERS)} FROM transactions {where} ORDER BY rowid"
+        with self._connect() as con:
+            df = pd.read_sql_query(sql, con, params=params, index_col="rowid")
+        df.index.name = None
+        return coerce_transactions(df)
+
+    def sync_transactions(self, prev=None):
+        return self._query_transactions(), None
+
+    def transactions_between(self, start: date, end: date) -> pd.DataFrame:
+        # end is inclusive; compare against the next day so "2024-01-31T10:00" still matches.
+        return self._query_transactions(
+            "WHERE tx_date >= ? AND tx_date < ?",
+            (start.isoformat(), (end + timedelta(days=1)).isoformat()),
+        )
+
+    def allocate_ids(self, n: int = 1) -> list:
+        # BEGIN IMMEDIATE takes the write lock, so other processes wait here.
+        # max(id) keeps the counter ahead of rows written without it (imports).
+        with self._write_lock, self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            start = con.execute(
+                "SELECT MAX((SELECT value FROM meta WHERE key = 'next_id'), "
+                "(SELECT COALESCE(MAX(id), 0) + 1 FROM transactions))"
+            ).fetchone()[0]
+            con.execute("UPDATE meta SET value = ? WHERE key = 'next_id'", (start + n,))
+        return list(range(start, start + n))
+
+    def append_transactions(self, rows):
+        values = [transaction_values(r) for r in rows]
+        with self._write_lock, self._connect() as con:
+            con.executemany(
+                f"INSERT INTO transactions ({', '.join(TX_HEADERS)}) VALUES ({', '.join('?' * len(TX_HEADERS))})",
+                values,
+            )
+            self._bump_revision(con)
+
+    def has_transaction(self, target_id: int) -> bool:
+        with self._connect() as con:
+            return con.execute("SELECT 1 FROM transactions WHERE id = ? LIMIT 1", (int(target_id),)).fetchone() is not None
+
+    def delete_transaction(self, target_id: int, hint=None):
+        # ix_transactions_id makes the lookup an index seek; no hint needed.
+        with self._write_lock, self._connect() as con:
+            found = con.execute(
+                "SELECT rowid FROM transactions WHERE id = ? ORDER BY rowid LIMIT 1", (int(target_id),)
+            ).fetchone()
+            if found is None:
+                return None
+            con.execute("DELETE FROM transactions WHERE rowid = ?", found)
+            self._bump_revision(con)
+            return found[0]
+
+    def transaction_labels(self, target_ids) -> dict:
+        ids = sorted({int(i) for i in target_ids})
+        if not ids:
+            return {}
+        with self._connect() as con:
+            found = con.execute(
+                f"SELECT rowid, id FROM transactions WHERE id IN ({', '.join('?' * len(ids))})", ids
+            ).fetchall()
+        return dict(found)
+
+    def delete_transactions(self, target_ids, hints=None) -> list:
+        # One transaction; each id takes the first of its rows not already taken.
+        labels = []
+        with self._write_lock, self._connect() as con:
+            for target_id in target_ids:
+                found = con.execute(
+                    f"SELECT rowid FROM transactions WHERE id = ? AND rowid NOT IN ({', '.join('?' * len(labels))}) "
+                    "ORDER BY rowid LIMIT 1",
+                    (int(target_id), *labels),
+                ).fetchone()
+                if found is not None:
+                    labels.append(found[0])
+            if labels:
+                con.executemany("DELETE FROM transactions WHERE rowid = ?", [(label,) for label in labels])
+                self._bump_revision(con)
+        return labels
+
+    def after_delete(self, df: pd.DataFrame, state, labels):
+        labels = list(labels)
+        if not pd.Index(labels).isin(df.index).all():
+            return None
+        return df.drop(index=labels), state
+
+    def update_transactions(self, edits) -> list:
+        # The check and the writes share one write transaction.
+        check_editable(edits)
+        with self._write_lock, self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            rowids = []
+            for e in edits:
+                found = None
+                if e["label"] is not None and e["label"] >= 0:
+                    found = con.execute(
+                        "SELECT rowid FROM transactions WHERE rowid = ? AND id = ?", (int(e["label"]), int(e["id"]))
+                    ).fetchone()
+                if found is None:
+                    found = con.execute(
+                        "SELECT rowid FROM transactions WHERE id = ? ORDER BY rowid LIMIT 1", (int(e["id"]),)
+                    ).fetchone()
+                rowids.append(None if found is None else found[0])
+
+            conflicts = [e["id"] for rowid, e in zip(rowids, edits) if rowid is None]
+            found = [(rowid, e) for rowid, e in zip(rowids, edits) if rowid is not None]
+            if found:
+                current = pd.read_sql_query(
+                    f"SELECT rowid, {', '.join(TX_HEADERS)} FROM transactions "
+                    f"WHERE rowid IN ({', '.join('?' * len(found))})",
+                    con,
+                    params=[rowid for rowid, _ in found],
+                    index_col="rowid",
+                )
+                fingerprints = transaction_fingerprints(coerce_transactions(current))
+                conflicts += [
+                    e["id"]
+                    for rowid, e in found
+                    if e["fingerprint"] is not None and fingerprints.get(rowid) != e["fingerprint"]
+                ]
+            if conflicts:
+                con.rollback()
+                raise ConcurrentEditError(conflicts)
+
+            for rowid, e in found:
+                if e["values"]:
+                    columns = ", ".join(f"{field} = ?" for field in e["values"])
+                    con.execute(f"UPDATE transactions SET {columns} WHERE rowid = ?", (*e["values"].values(), rowid))
+            self._bump_revision(con)
+        return [rowid for rowid, _ in found]
+
+    def read_achievement(self) -> pd.DataFrame:
+        with self._connect() as con:
+            df = pd.read_sql_query("SELECT year, month, target FROM achievement ORDER BY year, month", con)
+        return coerce_achievement(df)
+
+    def upsert_targets(self, targets):
+        rows = [(y, m, t) for (y, m), t in target_map(targets).items()]
+        with self._write_lock, self._connect() as con:
+            con.executemany(
+                "INSERT INTO achievement (year, month, target) VALUES (?, ?, ?) "
+                "ON CONFLICT (year, month) DO UPDATE SET target = excluded.target",
+                rows,
+            )
+            self._bump_revision(con)
+
+
+# -----------------------------
+# SQLite with a Sheets mirror
+# -----------------------------
+class MirroredBackend(StorageBackend):
+    """Reads from ``primary``; writes go to ``primary`` and then to ``mirror``.
+
+    The primary is the source of truth: a failed mirror write is kept in
+    ``mirror_error`` for the UI instead of failing the request.
+    """
+
+    def __init__(self, primary: StorageBackend, mirror: StorageBackend):
+        self.primary = primary
+        self.mirror = mirror
+        self.name = f"{primary.name}+{mirror.name}"
+        self.range_queries = primary.range_queries
+        self.has_achievement = primary.has_achievement
+        self.mirror_error = None
+
+    def cache_key(self, tab: str):
+        return self.primary.cache_key(tab)
+
+    def revision(self):
+        return self.primary.revision()
+
+    def sync_transactions(self, prev=None):
+        return self.primary.sync_transactions(prev)
+
+    def transactions_between(self, start: date, end: date) -> pd.DataFrame:
+        return self.primary.transactions_between(start, end)
+
+    def read_achievement(self) -> pd.DataFrame:
+        return self.primary.read_achievement()
+
+    def _mirror(self, method: str, *args):
+        if method == "upsert_targets" and not self.mirror.has_achievement:
+            return
+        try:
+            getattr(self.mirror, method)(*args)
+            self.mirror_error = None
+        except Exception as e:
+            self.mirror_error = f"{method}: {e}"
+
+    def allocate_ids(self, n: int = 1) -> list:
+        return self.primary.allocate_ids(n)
+
+    def append_transactions(self, rows):
+        rows = list(rows)
+        self.primary.append_transactions(rows)
+        self._mirror("append_transactions", rows)
+
+    def has_transaction(self, target_id: int) -> bool:
+        return self.primary.has_transaction(target_id)
+
+    def delete_transaction(self, target_id: int, hint=None):
+        label = self.primary.delete_transaction(target_id, hint)
+        if label is not None:
+            self._mirror("delete_transaction_by_id", target_id)
+        return label
+
+    def delete_transactions(self, target_ids, hints=None) -> list:
+        # Only the ids the primary actually deleted go to the mirror: the
+        # labels it returns are mapped back to ids read before the delete.
+        target_ids = list(target_ids)
+        ids_at = self.primary.transaction_labels(target_ids)
+        labels = self.primary.delete_transactions(target_ids, hints)
+        if labels:
+            self._mirror("delete_transactions_by_id", [ids_at[label] for label in labels if label in ids_at])
+        return labels
+
+    def after_delete(self, df: pd.DataFrame, state, labels):
+        return self.primary.after_delete(df, state, labels)
+
+    def update_transactions(self, edits) -> list:
+        labels = self.primary.update_transactions(edits)
+        # The primary already checked the fingerprints; the mirror finds rows by id.
+        self._mirror("update_transactions", [dict(e, label=None, fingerprint=None) for e in edits])
+        return labels
+
+    def after_update(self, df: pd.DataFrame, state, edits):
+        return self.primary.after_update(df, state, edits)
+
+    def upsert_targets(self, targets):
+        targets = list(targets)
+        self.primary.upsert_targets(targets)
+        self._mirror("upsert_targets", targets)
+
+
+# -----------------------------
+# Several entities, read together
+# -----------------------------
+class ConsolidatedBackend(StorageBackend):
+    """Read-only view over one backend per entity (e.g. one spreadsheet per company).
+
+    The app loads each part through its own cache entry and combines them
+    with ``consolidate_transactions``; writes go to a single entity's
+    backend. ``errors`` maps the entities that could not be opened or read
+    to a message, so the rest can still be shown.
+    """
+
+    name = "consolidated"
+    read_only = True
+
+    def __init__(self, parts: dict, errors: dict = None):
+        self.parts = parts
+        self.errors = dict(errors or {})
+        self.has_achievement = any(p.has_achievement for p in parts.values())
+
+    def cache_key(self, tab: str):
+        return (self.name, tuple(p.cache_key(tab) for p in self.parts.values()), tab)
+
+
+def consolidate_transactions(frames: dict) -> pd.DataFrame:
+    """One frame with a categorical ``source`` column (the entity label) and a fresh RangeIndex."""
+    tagged = []
+    for label, df in frames.items():
+        if df.empty:
+            continue
+        df = df.copy(deep=False)
+        df["source"] = pd.Categorical([label] * len(df), categories=list(frames))
+        tagged.append(df)
+    if not tagged:
+        return pd.DataFrame(columns=TX_HEADERS + ["source"])
+    out = tagged[0]
+    for df in tagged[1:]:
+        out = concat_transactions(out, df)
+    out.index = pd.RangeIndex(len(out))
+    return out
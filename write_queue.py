@@ -0,0 +1,311 @@
+"""Write-behind queue: writes show up at once and reach the backend from a worker thread.
+
+Queued operations are journaled to a JSON file before the caller returns, so
+a restart resumes them. The worker keeps FIFO order, coalesces neighbouring
+appends into one ``append_transactions`` call, neighbouring deletes into one
+``delete_transactions`` call and neighbouring target saves into one
+``upsert_targets`` call, and retries failures with exponential
+backoff (longer after a 429 quota error). Until an operation is flushed,
+``overlay`` / ``overlay_targets`` apply it to data read from the backend.
+"""
+
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+import pandas as pd
+
+from storage import TX_HEADERS, coerce_transactions, concat_transactions, target_map, transaction_values
+
+
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_QUOTA_SECONDS = 15.0  # Sheets quotas are per minute, so start higher after a 429
+BACKOFF_MAX_SECONDS = 120.0
+MAX_ATTEMPTS = 8  # then the operation is parked in the failed list
+
+
+def _is_quota_error(e: Exception) -> bool:
+    return getattr(getattr(e, "response", None), "status_code", None) == 429
+
+
+def _delete_landed(payload: dict, rows: dict) -> bool:
+    # A delete sent before a restart landed if no row has its id any more,
+    # or if the row at its hint no longer holds it. Rows that moved since
+    # also count as landed: dropping a delete is safer than deleting a
+    # second row with the same id.
+    labels = [label for label, row_id in rows.items() if row_id == payload["id"]]
+    if not labels:
+        return True
+    return payload["hint"] is not None and payload["hint"] not in labels
+
+
+class WriteBehindQueue:
+    def __init__(self, store, cache, journal_path: str):
+        self.store = store
+        self.cache = cache
+        self.journal_path = journal_path
+        self._cond = threading.Condition()
+        self._pending = []
+        self._failed = []
+        self._seq = itertools.count(1)
+        self._retry_at = 0.0
+        self._last_error = None
+        self._changes = 0  # bumped whenever the set of queued ops changes
+        self._thread = None
+        self._load_journal()
+
+    # -----------------------------
+    # Journal
+    # -----------------------------
+    def _load_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, encoding="utf-8") as f:
+            data = json.load(f)
+        for op in data.get("pending", []):
+            # Sent before a restart: the write may or may not have landed.
+            op["verify"] = op.get("sent", False)
+            op["sent"] = False
+        self._pending = data.get("pending", [])
+        self._failed = data.get("failed", [])
+        last = max((op["seq"] for op in self._pending + self._failed), default=0)
+        self._seq = itertools.count(last + 1)
+
+    def _save_journal(self):
+        # Called with self._cond held, after every change to the queue.
+        self._changes += 1
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pending": self._pending, "failed": self._failed}, f, ensure_ascii=False)
+        os.replace(tmp, self.journal_path)
+
+    # -----------------------------
+    # Producer side
+    # -----------------------------
+    def _enqueue(self, kind: str, payload):
+        self._enqueue_many(kind, [payload])
+
+    def _enqueue_many(self, kind: str, payloads):
+        # One journal write for the whole group.
+        with self._cond:
+            for payload in payloads:
+                self._pending.append(dict(seq=next(self._seq), kind=kind, payload=payload, attempts=0, sent=False))
+            self._save_journal()
+            self._cond.notify()
+
+    def enqueue_append(self, row: dict):
+        self._enqueue("append", dict(row))
+
+    def enqueue_delete(self, target_id: int, hint=None):
+        self.enqueue_deletes([target_id], [hint])
+
+    def enqueue_deletes(self, target_ids, hints=None):
+        # Deleting a row that is still waiting to be appended just drops the append.
+        hints = hints or [None] * len(target_ids)
+        payloads = []
+        with self._cond:
+            dropped = False
+            for target_id, hint in zip(target_ids, hints):
+                queued = next(
+                    (
+                        op
+                        for op in self._pending
+                        if op["kind"] == "append" and not op["sent"] and int(op["payload"]["id"]) == int(target_id)
+                    ),
+                    None,
+                )
+                if queued is not None:
+                    self._pending.remove(queued)
+                    dropped = True
+                else:
+                    # Negative labels are queued or archived rows, not sheet rows: no hint.
+                    hint = None if hint is None or int(hint) < 0 else int(hint)
+                    payloads.append(dict(id=int(target_id), hint=hint))
+            if payloads:
+                self._enqueue_many("delete", payloads)  # the condition's lock is re-entrant
+            elif dropped:
+                self._save_journal()
+
+    def enqueue_targets(self, targets):
+        self._enqueue("targets", [[int(y), int(m), float(t)] for y, m, t in targets])
+
+    def version(self) -> int:
+        """Changes whenever what ``overlay`` would apply may have changed."""
+        with self._cond:
+            return self._changes
+
+    def status(self) -> dict:
+        with self._cond:
+            return dict(pending=len(self._pending), failed=len(self._failed), last_error=self._last_error)
+
+    def retry_failed(self):
+        with self._cond:
+            for op in self._failed:
+                op["attempts"] = 0
+            self._pending = self._failed + self._pending
+            self._failed = []
+            self._retry_at = 0.0
+            self._save_journal()
+            self._cond.notify()
+
+    def discard_failed(self):
+        with self._cond:
+            self._failed = []
+            self._save_journal()
+
+    # -----------------------------
+    # Read overlay
+    # -----------------------------
+    def _snapshot(self):
+        with self._cond:
+            appends = [(op["seq"], op["payload"]) for op in self._pending if op["kind"] == "append"]
+            deletes = [op["payload"]["id"] for op in self._pending if op["kind"] == "delete"]
+            targets = [t for op in self._pending if op["kind"] == "targets" for t in op["payload"]]
+        return appends, deletes, targets
+
+    def pending_changes(self, df: pd.DataFrame, start=None, end=None):
+        """``(added, removed)``: queued rows missing from ``df``, and rows of ``df`` queued for deletion.
+
+        A queued row's index label is minus its op's ``seq``, so it never
+        collides with backend labels and does not move while the row stays
+        queued. ``start``/``end`` restrict the queued rows to a date range,
+        for frames that are range query results.
+        """
+        appends, deletes, _ = self._snapshot()
+        removed = []
+        if deletes and not df.empty:
+            for target_id in deletes:
+                hit = df.index[((df["id"] == target_id) & ~df.index.isin(removed)).to_numpy()]
+                if len(hit):
+                    removed.append(hit[0])
+        removed = df.loc[removed] if removed else df.iloc[:0]
+
+        if not appends:
+            return df.iloc[:0], removed
+        new = coerce_transactions(pd.DataFrame([transaction_values(r) for _, r in appends], columns=TX_HEADERS))
+        new.index = pd.Index([-seq for seq, _ in appends], dtype="int64")
+        if not df.empty:
+            # Already flushed but not yet dropped from the queue.
+            new = new[~new["id"].isin(df["id"])]
+        if start is not None:
+            day = new["tx_date"].dt.date
+            new = new[(day >= start) & (day <= end)]
+        return new, removed
+
+    def overlay(self, df: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+        """``df`` as it will look once the queued appends/deletes are flushed."""
+        added, removed = self.pending_changes(df, start, end)
+        if added.empty and removed.empty:
+            return df
+
+        out = df.drop(index=removed.index) if not removed.empty else df
+        if not added.empty:
+            out = added if out.empty else concat_transactions(out, added)
+        out.attrs = dict(df.attrs)  # data_version (and cache_key) of the frame it overlays
+        return out
+
+    def overlay_targets(self, ach_df: pd.DataFrame) -> pd.DataFrame:
+        _, _, targets = self._snapshot()
+        if not targets:
+            return ach_df
+        queued = pd.DataFrame(
+            [[y, m, t] for (y, m), t in target_map(targets).items()], columns=["year", "month", "target"]
+        )
+        if ach_df.empty:
+            return queued
+        keys = pd.MultiIndex.from_frame(queued[["year", "month"]])
+        kept = ach_df[~pd.MultiIndex.from_frame(ach_df[["year", "month"]]).isin(keys)]
+        return pd.concat([kept, queued], ignore_index=True)
+
+    # -----------------------------
+    # Worker
+    # -----------------------------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        # Called with self._cond held: the head op plus its same-kind neighbours.
+        if not self._pending or time.monotonic() < self._retry_at:
+            return []
+        kind = self._pending[0]["kind"]
+        return list(itertools.takewhile(lambda op: op["kind"] == kind, self._pending))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                if not batch:
+                    wait = max(self._retry_at - time.monotonic(), 0) if self._pending else None
+                    self._cond.wait(timeout=wait)
+                    continue
+                for op in batch:
+                    op["sent"] = True
+                self._save_journal()
+
+            try:
+                self._apply(batch)
+            except Exception as e:
+                self._failed_attempt(batch, e)
+                continue
+
+            with self._cond:
+                done = {op["seq"] for op in batch}
+                self._pending = [op for op in self._pending if op["seq"] not in done]
+                self._last_error = None
+                self._save_journal()
+
+    def _failed_attempt(self, batch, e: Exception):
+        with self._cond:
+            head = batch[0]
+            head["attempts"] += 1
+            for op in batch:
+                op["sent"] = False
+            base = BACKOFF_QUOTA_SECONDS if _is_quota_error(e) else BACKOFF_BASE_SECONDS
+            delay = min(base * 2 ** (head["attempts"] - 1), BACKOFF_MAX_SECONDS)
+            self._retry_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+            self._last_error = f"{type(e).__name__}: {e}"
+            if head["attempts"] >= MAX_ATTEMPTS:
+                for op in batch:
+                    op["error"] = self._last_error
+                done = {op["seq"] for op in batch}
+                self._pending = [op for op in self._pending if op["seq"] not in done]
+                self._failed.extend(batch)
+                self._retry_at = 0.0
+            self._save_journal()
+
+    def _apply(self, batch):
+        kind = batch[0]["kind"]
+        store = self.store
+        if kind == "append":
+            rows = [
+                op["payload"]
+                for op in batch
+                if not (op.get("verify") and store.has_transaction(op["payload"]["id"]))
+            ]
+            if rows:
+                store.append_transactions(rows)
+                self.cache.invalidate(store.cache_key("transactions"), full=False)
+        elif kind == "delete":
+            checked = [op["payload"]["id"] for op in batch if op.get("verify")]
+            rows = store.transaction_labels(checked) if checked else {}
+            batch = [op for op in batch if not (op.get("verify") and _delete_landed(op["payload"], rows))]
+            if not batch:
+                return
+            labels = store.delete_transactions(
+                [op["payload"]["id"] for op in batch], [op["payload"]["hint"] for op in batch]
+            )
+            if labels:
+                self.cache.patch(
+                    store.cache_key("transactions"),
+                    lambda df, state: store.after_delete(df, state, labels),
+                    removed_labels=labels,
+                )
+        elif kind == "targets":
+            store.upsert_targets([t for op in batch for t in op["payload"]])
+            self.cache.invalidate(store.cache_key("achievement"))